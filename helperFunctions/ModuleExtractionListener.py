@@ -1,78 +1,103 @@
+import sys
 from antlr4 import *
 from antlr_build.CLexer import CLexer
 from antlr_build.CParser import CParser
 from antlr_build.CListener import CListener
+from helperFunctions.symbolEdges import OTHER_SYMBOL, MACRO_SYMBOL, FILE_SCOPE
 
 def list_methods(obj):
     methods = [method_name for method_name in dir(obj) if callable(getattr(obj, method_name))]
     return methods
 
 class ModuleExtractionListener(CListener):
-    def __init__(self, list_of_lists):
-        self.var_def = list_of_lists[0]
-        self.var_call = list_of_lists[1]
-        self.macro_call = list_of_lists[2]
+    def __init__(self, list_of_sets, symbol_edges=None):
+        # Sets so every symbol is only stored once per file, names are interned
+        # so the same symbol seen in many files shares one string
+        self.var_def = list_of_sets[0]
+        self.var_call = list_of_sets[1]
+        self.macro_call = list_of_sets[2]
+        # Optional SymbolEdgeCollector for the symbol level graph
+        self.symbol_edges = symbol_edges
+        self.current_function = '' # Uses outside a function belong to the file
 
-    def exitTranslationUnit(self, ctx: CParser.TranslationUnitContext):
-        # Uniquify the lists
-        self.var_def = list(set(self.var_def))
-        self.var_call = list(set(self.var_call))
-        self.macro_call = list(set(self.macro_call))
+    def addCall(self, name, ctx):
+        self.var_call.add(name)
+        if self.symbol_edges is not None:
+            self.addEdgeHelper(name, OTHER_SYMBOL, ctx)
+
+    def addMacroCall(self, name, ctx):
+        self.macro_call.add(name)
+        if self.symbol_edges is not None:
+            self.addEdgeHelper(name, MACRO_SYMBOL, ctx)
+
+    def addEdgeHelper(self, name, target_kind, ctx):
+        source_kind = OTHER_SYMBOL if self.current_function else FILE_SCOPE
+        self.symbol_edges.addEdge(self.current_function, source_kind, name, target_kind, ctx.start.line)
 
     def enterFunctionDefinition(self, ctx):
         # Function definition
         if ctx.declarator().directDeclarator().directDeclarator() is not None:
             func_name = ctx.declarator().directDeclarator().directDeclarator().getText()
-            self.var_def.append(func_name)
+            self.var_def.add(sys.intern(func_name))
+            self.current_function = sys.intern(func_name)
             #print("Func Def:", func_name)
-    
+
+    def exitFunctionDefinition(self, ctx):
+        self.current_function = ''
+
     def enterPostfixExpression(self, ctx: CParser.PostfixExpressionContext):
         # Function call
         if ctx.LeftParen() and  ctx.RightParen():
             if ctx.primaryExpression() is not None:
                 func_name = ctx.primaryExpression().getText()
-                self.var_call.append(func_name)
+                self.addCall(sys.intern(func_name), ctx)
                 #print("Func Call:", func_name)
 
+    def enterPrimaryExpression(self, ctx: CParser.PrimaryExpressionContext):
+        # Any name used in an expression could be an object-like macro (constants, flags)
+        # Only names some file #defines are counted as macro uses
+        if ctx.Identifier() is not None:
+            self.addMacroCall(sys.intern(ctx.Identifier().getText()), ctx)
+
     def enterStructOrUnionSpecifier(self, ctx: CParser.PostfixExpressionContext):
         # Struct definition
         if ctx.LeftBrace() and  ctx.RightBrace():
             if ctx.Identifier() is not None:
                 struct_name = ctx.Identifier().getText()
-                self.var_def.append(struct_name)
+                self.var_def.add(sys.intern(struct_name))
                 #print("Struct Def:", struct_name)
     
     def enterSpecifierQualifierList(self, ctx):
         if ctx.typeSpecifier() is not None:
             if ctx.typeSpecifier().typedefName() is not None:
                 struct_name = ctx.typeSpecifier().typedefName().getText()
-                self.var_call.append(struct_name)
+                self.addCall(sys.intern(struct_name), ctx)
                 #print("Struct Type Usage:", struct_name)
     
     def enterDeclarationSpecifier(self, ctx):
         if isinstance(ctx.parentCtx.parentCtx, CParser.FunctionDefinitionContext):
             type_name = ctx.getText()
-            self.var_call.append(type_name)
+            self.addCall(sys.intern(type_name), ctx)
             # print("Func type:", type_name)
         if isinstance(ctx.parentCtx.parentCtx, CParser.ParameterDeclarationContext):
             type_name = ctx.getText()
-            self.var_call.append(type_name)
+            self.addCall(sys.intern(type_name), ctx)
             # print("Variable type:", type_name)
     
     def enterTypedefName(self, ctx: CParser.TypedefNameContext):
         if ctx.Identifier() is not None:
             if isinstance(ctx.parentCtx.parentCtx.parentCtx, CParser.DeclarationSpecifiersContext):
                 type_name = ctx.getText()
-                self.var_def.append(type_name)
+                self.var_def.add(sys.intern(type_name))
                 #print("struct/enum declaration", type_name)
             else:
                 type_name = ctx.getText()
-                self.var_call.append(type_name)
+                self.addCall(sys.intern(type_name), ctx)
                 #print("struct/enum call:", type_name)
 
     def enterMacroName(self, ctx: CParser.MacroNameContext):
         # Macros are defined in the #define statements so everything seen is a call
         if ctx.Identifier() is not None:
             macro_name = ctx.getText()
-            self.macro_call.append(macro_name)
+            self.addMacroCall(sys.intern(macro_name), ctx)
             #print("macro call:", macro_name)
@@ -0,0 +1,139 @@
+import time
+# ANTLR packages
+from antlr_build.CLexer import CLexer
+from antlr_build.CParser import CParser
+from helperFunctions.ModuleExtractionListener import ModuleExtractionListener
+from helperFunctions.tokenExtraction import extractTokenSymbols
+from helperFunctions.symbolEdges import SymbolEdgeCollector
+from antlr4 import *
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+
+# Number of syntax error messages kept for each file
+MAX_ERROR_SAMPLES = 5
+
+class ParseBudgetExceeded(Exception):
+    pass
+
+class SyntaxErrorCollector(ErrorListener):
+    # Counts syntax errors per grammar rule instead of formatting every one to stderr
+    def __init__(self, max_errors=0):
+        self.max_errors = max_errors
+        self.error_count = 0 # Parser errors only, lexer errors don't stop the parse
+        self.rule_errors = {} # key = rule name (or 'lexer'), value = # of errors
+        self.samples = [] # The first MAX_ERROR_SAMPLES messages
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        if isinstance(recognizer, Lexer):
+            rule = 'lexer'
+        else:
+            self.error_count += 1
+            rule = 'unknown'
+            if recognizer._ctx is not None:
+                rule = recognizer.ruleNames[recognizer._ctx.getRuleIndex()]
+        self.rule_errors[rule] = self.rule_errors.get(rule, 0) + 1
+        if len(self.samples) < MAX_ERROR_SAMPLES:
+            self.samples.append(f"line {line}:{column} {msg}")
+        # Give up on files that are too broken for the parse tree to be worth anything
+        if self.max_errors and self.error_count >= self.max_errors:
+            raise ParseBudgetExceeded('errors')
+
+class ParseDeadlineListener(ParseTreeListener):
+    # Abandons the parse once the file's wall time budget is used up
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def checkDeadline(self):
+        if time.perf_counter() > self.deadline:
+            raise ParseBudgetExceeded('time')
+
+    def enterEveryRule(self, ctx):
+        self.checkDeadline()
+
+    def visitTerminal(self, node):
+        self.checkDeadline()
+
+def parseTranslationUnit(parser, two_stage_parse):
+    # Returns the parse tree and whether the SLL stage had to fall back to LL
+    if not two_stage_parse:
+        return parser.translationUnit(), 0
+    # Try the fast SLL prediction first and bail out on the first syntax error
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    error_listeners = parser._listeners
+    parser.removeErrorListeners()
+    try:
+        return parser.translationUnit(), 0
+    except ParseCancellationException:
+        # Only fall back to full LL prediction (and error reporting) when SLL fails
+        parser.reset()
+        parser._listeners = error_listeners
+        parser._errHandler = DefaultErrorStrategy()
+        parser._interp.predictionMode = PredictionMode.LL
+        return parser.translationUnit(), 1
+
+def packEdgesHelper(results, edge_collector):
+    if edge_collector is not None:
+        results['symbol_names'], results['symbol_edges'] = edge_collector.pack()
+    return results
+
+def extractAntlrSymbols(source_text, two_stage_parse=0, time_budget=0, token_budget=0, extractor='antlr',
+                        max_errors=0, symbol_edges=0):
+    # Parse a file's contents and return only the extracted symbol lists (no parse tree)
+    # With symbol_edges set, the uses between symbols are returned packed as well
+    # Kept at module level so it can be sent to worker processes
+    # ANTLR stream over the buffer that was already read for the regex pass
+    input_stream = InputStream(source_text)
+    # Tokenize the strings and stream the tokens to the parser
+    lexer = CLexer(input_stream)
+    error_collector = SyntaxErrorCollector(max_errors)
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(error_collector)
+    stream = CommonTokenStream(lexer)
+    edge_collector = SymbolEdgeCollector() if symbol_edges else None
+    results = {
+        'antlr_errors': 0,
+        'antlr_ll_fallback': 0,
+        'budget_fallback': '', # Set to the budget that was exceeded
+        'antlr_error_rules': error_collector.rule_errors,
+        'antlr_error_samples': error_collector.samples
+    }
+    # Lexer-only extraction, the parser never runs
+    if extractor == 'tokens':
+        stream.fill()
+        results.update(extractTokenSymbols(stream.tokens, edge_collector))
+        return packEdgesHelper(results, edge_collector)
+    # Files with too many tokens never reach the parser
+    if token_budget:
+        stream.fill()
+        token_count = len([t for t in stream.tokens if t.channel == Token.DEFAULT_CHANNEL])
+        if token_count > token_budget:
+            results['budget_fallback'] = 'tokens'
+    if not results['budget_fallback']:
+        parser = CParser(stream)
+        parser.removeErrorListeners()
+        parser.addErrorListener(error_collector)
+        if time_budget:
+            parser.addParseListener(ParseDeadlineListener(time.perf_counter() + time_budget))
+        # Build a tree from the C grammar's "translationUnit" rule
+        try:
+            tree, results['antlr_ll_fallback'] = parseTranslationUnit(parser, two_stage_parse)
+        except ParseBudgetExceeded as budget:
+            results['budget_fallback'] = budget.args[0]
+        results['antlr_errors'] = parser.getNumberOfSyntaxErrors()
+    # Approximate the symbols from the tokens when the file is over budget
+    if results['budget_fallback']:
+        stream.fill()
+        results.update(extractTokenSymbols(stream.tokens, edge_collector))
+        return packEdgesHelper(results, edge_collector)
+    # Walk the tree with the listener
+    walker = ParseTreeWalker()
+    results['other_definitions'] = set()
+    results['other_dependencies'] = set()
+    results['macro_dependencies'] = set()
+    result_sets = [results['other_definitions'],
+                   results['other_dependencies'],
+                   results['macro_dependencies']]
+    walker.walk(ModuleExtractionListener(result_sets, edge_collector), tree)
+    return packEdgesHelper(results, edge_collector)
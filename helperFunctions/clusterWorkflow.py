@@ -1,5 +1,6 @@
 import os
 import re
+import pickle
 from helperFunctions.graphVisualization import GraphVisualization
 import helperFunctions.nodesStructs as nodesStructs
 from contextlib import redirect_stdout
@@ -25,6 +26,7 @@ def runGraphGeneration(objects_list, algorithm, k, graph_name, random_samples,
     files_list = []
     for obj in filtered_objects:
         getLeafFilesHelper(obj, files_list)
+    files_names = {f.name for f in files_list}
 
     def addEdgeHelper(graph, file, top_level_parent, objects_list, files_list):
         # Resolve the from node name
@@ -39,7 +41,7 @@ def runGraphGeneration(objects_list, algorithm, k, graph_name, random_samples,
             if file.name == dependancy:
                 continue
             # Check that the dependency is part of the partition
-            if dependancy not in [f.name for f in files_list]:
+            if dependancy not in files_names:
                 continue
 
             # Resolve the to node name (check if it has a parent cluster)
@@ -74,12 +76,11 @@ def runGraphGeneration(objects_list, algorithm, k, graph_name, random_samples,
             # Get the edge weight
             edge_weight = file.file_dependencies[dependancy]
             # Check if the reverse edge already exists and sum the weights if so
-            reverse_edge = [to_node, from_node]
-            for i, (a,b,c) in enumerate(graph.edges_list):
-                if [a,b] == reverse_edge:
-                    graph.edges_list[i] = (a, b, c + edge_weight)
-                    graph.inbound_dependencies[b] += edge_weight
-                    break
+            reverse_position = graph.edge_positions.get((to_node, from_node))
+            if reverse_position is not None:
+                a, b, c = graph.edges_list[reverse_position]
+                graph.edges_list[reverse_position] = (a, b, c + edge_weight)
+                graph.inbound_dependencies[b] += edge_weight
             else:
                 graph.addEdge(from_node, to_node, edge_weight)
 
@@ -123,7 +124,10 @@ def runGraphGeneration(objects_list, algorithm, k, graph_name, random_samples,
     return mean_mq, clusters
 
 def executeClusterWorkflow(files_dict, algorithm, source_dir, output_dir, k_values,
-                           random_samples, directories_of_interest, project_name, max_plot_depth):
+                           random_samples, directories_of_interest, project_name, max_plot_depth,
+                           changed_files=None):
+    # With changed_files set, levels that none of those files are part of keep the clusters
+    # saved by the last run instead of being clustered (and plotted) again
     # Recursive function to traverse into the directory tree
     def clusterRecursionHelper(files_list, base_dir, current_depth, plot_depth,
                                 clusters_dict, graph_dir, k_target, k_other):
@@ -182,9 +186,17 @@ def executeClusterWorkflow(files_dict, algorithm, source_dir, output_dir, k_valu
         if k_resolved == -1:
             color_by_dependencies_flag = 1
         
-        # Cluster the files
-        mean_mq, clusters = runGraphGeneration(new_files_list, algorithm, k_resolved, graph_name,
-                                random_samples, generate_plot, base_dir, color_by_dependencies_flag)
+        # Cluster the files, unless the level's subgraph is the same as in the last run
+        stored_level = stored_clusters.get(base_dir_resolved)
+        level_changed = changed_files is None or any([base_dir in name for name in changed_files])
+        if stored_level is not None and not level_changed and \
+                {name for names in stored_level[1].values() for name in names} <= {obj.name for obj in new_files_list}:
+            mean_mq, clusters = stored_level
+            saved_clusters[base_dir_resolved] = stored_level
+        else:
+            mean_mq, clusters = runGraphGeneration(new_files_list, algorithm, k_resolved, graph_name,
+                                    random_samples, generate_plot, base_dir, color_by_dependencies_flag)
+            saved_clusters[base_dir_resolved] = (mean_mq, clusters)
 
         # Build ClusterNodes for the current level
         cluster_nodes = {}
@@ -221,11 +233,27 @@ def executeClusterWorkflow(files_dict, algorithm, source_dir, output_dir, k_valu
         graph_dir = f"{output_dir}/graphs_{algorithm}/"
     os.makedirs(graph_dir, exist_ok=True)
 
+    # Clusters of the last run, only valid for the same clustering settings
+    clusters_path = f'{graph_dir}/clusters.pkl'
+    cluster_settings = (algorithm, tuple(k_values), random_samples, tuple(directories_of_interest))
+    stored_clusters = {}
+    if changed_files is not None and os.path.exists(clusters_path):
+        with open(clusters_path, 'rb') as f:
+            settings, levels = pickle.load(f)
+        if settings == cluster_settings:
+            stored_clusters = levels
+    saved_clusters = {} # key = level, value = (MQ, key = cluster ID, value = member names)
+
     # Flatten the files
     files_list = [file for run_dir in files_dict.keys() for file in files_dict[run_dir].values()]
     
     clusters_dict = {}
     clusterRecursionHelper(files_list, '', 0, 3, clusters_dict, graph_dir, k_values[0], k_values[0])
+    with open(clusters_path, 'wb') as f:
+        pickle.dump((cluster_settings, saved_clusters), f)
+    if changed_files is not None:
+        reused_levels = len([level for level in saved_clusters if saved_clusters[level] is stored_clusters.get(level)])
+        print(f"Reused the clusters of {reused_levels} of {len(saved_clusters)} directory levels.")
 
     # Recursively execute at each depth
     #for depth in range(max_plot_depth):
@@ -255,3 +283,5 @@ def executeClusterWorkflow(files_dict, algorithm, source_dir, output_dir, k_valu
                     total_macros = sum([len(f.macro_definitions) for f in leaf_file_objects])
                     cluster_children_string = '; '.join(map(str,cluster_children))
                     print(f"{cluster_instance},{mq_value},{total_files},{lines_of_code},{total_functions},{total_macros},{cluster_children_string}")
+
+    return clusters_dict
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import shlex
+
+# Flags that add an include search path, either joined (-Ipath) or as the next argument
+INCLUDE_FLAGS = ('-I', '-isystem', '-iquote', '-idirafter')
+
+def getCompileFlags(arguments, directory):
+    # Pull the include paths and macro definitions out of one compiler command line
+    include_paths = []
+    defines = {} # key = macro name, value = macro value (None if explicitly undefined)
+    i = 0
+    while i < len(arguments):
+        argument = arguments[i]
+        flag = None
+        for option in INCLUDE_FLAGS + ('-D', '-U'):
+            if argument == option and i + 1 < len(arguments):
+                flag, flag_value = option, arguments[i + 1]
+                i += 1
+                break
+            if argument.startswith(option) and len(argument) > len(option):
+                flag, flag_value = option, argument[len(option):]
+                break
+        i += 1
+        if flag is None:
+            continue
+        if flag in INCLUDE_FLAGS:
+            path = os.path.normpath(os.path.join(directory, flag_value))
+            if path not in include_paths:
+                include_paths.append(path)
+        elif flag == '-D':
+            name, separator, value = flag_value.partition('=')
+            defines[name] = value if separator else '1'
+        elif flag == '-U':
+            defines[flag_value] = None
+    return include_paths, defines
+
+def getDefineFlags(defines, undefines):
+    # Command line -D NAME[=VALUE] and -U NAME options, parsed the same way as a compiler's
+    arguments = ['-D' + define for define in defines] + ['-U' + undefine for undefine in undefines]
+    return getCompileFlags(arguments, os.getcwd())[1]
+
+def readCompileCommands(compile_commands_path):
+    # Returns one entry per translation unit with its own include paths and defines
+    with open(compile_commands_path, 'r') as f:
+        entries = json.load(f)
+    translation_units = {} # key = absolute file path
+    for entry in entries:
+        directory = entry.get('directory', os.path.dirname(os.path.abspath(compile_commands_path)))
+        if 'arguments' in entry:
+            arguments = entry['arguments']
+        else:
+            arguments = shlex.split(entry['command'])
+        file_path = os.path.normpath(os.path.join(directory, entry['file']))
+        # A file compiled more than once keeps the flags of its first entry
+        if file_path in translation_units:
+            continue
+        include_paths, defines = getCompileFlags(arguments[1:], directory)
+        translation_units[file_path] = {
+            'file': file_path,
+            'include_paths': tuple(sys.intern(path) for path in include_paths),
+            'defines': defines
+        }
+    return list(translation_units.values())
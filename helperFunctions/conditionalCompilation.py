@@ -0,0 +1,302 @@
+import re
+
+# Pre-processor directives that change which lines are compiled
+DIRECTIVE_REGEX = re.compile(r'\s*#\s*(if|ifdef|ifndef|elif|else|endif|define|undef)\b(.*)', re.DOTALL)
+DEFINE_REGEX = re.compile(r'\s*(\w+)(\()?(.*)', re.DOTALL)
+CONDITION_TOKEN_REGEX = re.compile(r"\s*(0[xX][0-9a-fA-F]+\w*|\d+\w*|\w+|'(?:\\.|[^\\'])*'|&&|\|\||==|!=|<=|>=|<<|>>|\S)")
+# Binary operators by precedence level, lowest first
+BINARY_OPERATORS = (
+    ('|',), ('^',), ('&',), ('==', '!='), ('<', '>', '<=', '>='), ('<<', '>>'), ('+', '-'), ('*', '/', '%')
+)
+
+class ConditionError(Exception):
+    pass
+
+class ConditionEvaluator():
+    # Evaluates an #if expression to 1, 0 or None when it depends on a macro we don't know
+    def __init__(self, defines, depth=0):
+        self.defines = defines # key = macro name, value = replacement text (None if undefined)
+        self.depth = depth
+        self.tokens = []
+        self.position = 0
+
+    def evaluate(self, condition):
+        self.tokens = CONDITION_TOKEN_REGEX.findall(condition)
+        self.position = 0
+        try:
+            value = self.parseTernary()
+            if self.position != len(self.tokens):
+                raise ConditionError(condition)
+        except (ConditionError, ZeroDivisionError, ValueError, IndexError):
+            return None
+        return value
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ConditionError("unexpected end of condition")
+        self.position += 1
+        return token
+
+    def expect(self, token):
+        if self.next() != token:
+            raise ConditionError(f"expected {token}")
+
+    def parseTernary(self):
+        condition = self.parseLogical('||')
+        if self.peek() != '?':
+            return condition
+        self.next()
+        true_value = self.parseTernary()
+        self.expect(':')
+        false_value = self.parseTernary()
+        if condition is None:
+            return true_value if true_value == false_value else None
+        return true_value if condition else false_value
+
+    def parseLogical(self, operator):
+        # && and || decide the result from one known side even when the other is unknown
+        parse_operand = (lambda: self.parseLogical('&&')) if operator == '||' else (lambda: self.parseBinary(0))
+        value = parse_operand()
+        while self.peek() == operator:
+            self.next()
+            right = parse_operand()
+            if operator == '||':
+                if value or right:
+                    value = 1
+                elif value is None or right is None:
+                    value = None
+                else:
+                    value = 0
+            else:
+                if value == 0 or right == 0:
+                    value = 0
+                elif value is None or right is None:
+                    value = None
+                else:
+                    value = 1
+        return value
+
+    def parseBinary(self, level):
+        if level == len(BINARY_OPERATORS):
+            return self.parseUnary()
+        value = self.parseBinary(level + 1)
+        while self.peek() in BINARY_OPERATORS[level]:
+            operator = self.next()
+            right = self.parseBinary(level + 1)
+            if value is None or right is None:
+                value = None
+            else:
+                value = self.applyOperator(operator, value, right)
+        return value
+
+    def applyOperator(self, operator, left, right):
+        if operator == '/':
+            return int(left / right)
+        if operator == '%':
+            return left - right * int(left / right)
+        return int({
+            '|': lambda: left | right, '^': lambda: left ^ right, '&': lambda: left & right,
+            '==': lambda: left == right, '!=': lambda: left != right,
+            '<': lambda: left < right, '>': lambda: left > right,
+            '<=': lambda: left <= right, '>=': lambda: left >= right,
+            '<<': lambda: left << right, '>>': lambda: left >> right,
+            '+': lambda: left + right, '-': lambda: left - right, '*': lambda: left * right
+        }[operator]())
+
+    def parseUnary(self):
+        token = self.peek()
+        if token in ('!', '~', '-', '+'):
+            self.next()
+            value = self.parseUnary()
+            if value is None:
+                return None
+            return {'!': int(not value), '~': ~value, '-': -value, '+': value}[token]
+        return self.parsePrimary()
+
+    def parsePrimary(self):
+        token = self.next()
+        if token == '(':
+            value = self.parseTernary()
+            self.expect(')')
+            return value
+        if token == 'defined':
+            if self.peek() == '(':
+                self.next()
+                name = self.next()
+                self.expect(')')
+            else:
+                name = self.next()
+            if name not in self.defines:
+                return None
+            return int(self.defines[name] is not None)
+        if token[0].isdigit():
+            return int(token.rstrip('uUlL'), 0) if not re.match(r'0\d', token) else int(token.rstrip('uUlL'), 8)
+        if token[0] == "'":
+            return ord(token[1:-1].encode().decode('unicode_escape')[0])
+        if re.match(r'\w+$', token):
+            # Function-like macros (and __has_include) can't be evaluated without expanding them
+            if self.peek() == '(':
+                self.skipArguments()
+                return None
+            if token not in self.defines:
+                return None
+            if self.defines[token] is None:
+                return 0 # Explicitly undefined, identifiers that aren't macros are 0
+            if self.depth > 10:
+                return None
+            return ConditionEvaluator(self.defines, self.depth + 1).evaluate(self.defines[token])
+        raise ConditionError(f"unexpected {token}")
+
+    def skipArguments(self):
+        depth = 0
+        while True:
+            token = self.next()
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                if depth == 0:
+                    return
+
+def stripComments(line, in_comment):
+    # Returns the line without comments and whether a block comment is still open at its end
+    if not in_comment and '/' not in line:
+        return line, 0
+    code = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            end = line.find('*/', i)
+            if end < 0:
+                return ''.join(code), 1
+            in_comment = 0
+            i = end + 2
+        else:
+            block_start = line.find('/*', i)
+            line_start = line.find('//', i)
+            if line_start >= 0 and (block_start < 0 or line_start < block_start):
+                code.append(line[i:line_start])
+                return ''.join(code), 0
+            if block_start < 0:
+                code.append(line[i:])
+                break
+            code.append(line[i:block_start] + ' ')
+            in_comment = 1
+            i = block_start + 2
+    return ''.join(code), in_comment
+
+def blankCode(line, in_comment):
+    # Masks one physical line but keeps the block comments in it, so a comment opened or
+    # closed on a line that isn't masked still has both ends
+    # Returns the masked line and whether a block comment is still open at its end
+    ending = line[len(line.rstrip('\r\n')):]
+    if not in_comment and '/*' not in line:
+        return ending, 0
+    kept = []
+    i = 0
+    text = line[:len(line) - len(ending)]
+    while i < len(text):
+        if in_comment:
+            end = text.find('*/', i)
+            if end < 0:
+                kept.append(text[i:])
+                break
+            kept.append(text[i:end + 2])
+            in_comment = 0
+            i = end + 2
+        else:
+            block_start = text.find('/*', i)
+            line_start = text.find('//', i)
+            if block_start < 0 or (0 <= line_start < block_start):
+                break
+            kept.append(' ' * (block_start - i) + '/*')
+            in_comment = 1
+            i = block_start + 2
+    kept = ''.join(kept)
+    return (kept if kept.strip() else '') + ending, in_comment
+
+def combineStates(parent_state, state):
+    # 1 is compiled, 0 is not, None is unknown
+    if parent_state == 0 or state == 0:
+        return 0
+    if parent_state is None or state is None:
+        return None
+    return 1
+
+def maskInactiveRegions(source_text, defines):
+    # Blanks out the lines of #if branches that can't be compiled with these defines
+    # Newlines are kept so line numbers (and the line count) don't change
+    # Returns the masked text and the number of lines masked
+    defines = dict(defines)
+    evaluator = ConditionEvaluator(defines)
+    lines = source_text.splitlines(keepends=True)
+    # One entry per open #if: [state of the enclosing region, state of the branch, taken by an earlier branch]
+    regions = []
+    state = 1
+    in_comment = 0
+    masked_lines = 0
+    i = 0
+    while i < len(lines):
+        # Join backslash continued lines into one logical line
+        start = i
+        logical_line = lines[i].rstrip('\r\n')
+        while logical_line.endswith('\\') and i + 1 < len(lines):
+            i += 1
+            logical_line = logical_line[:-1] + lines[i].rstrip('\r\n')
+        i += 1
+        line_in_comment = in_comment
+        code, next_in_comment = stripComments(logical_line, in_comment)
+        directive = DIRECTIVE_REGEX.match(code) if not in_comment else None
+        in_comment = next_in_comment
+        line_state = state
+        if directive:
+            keyword, argument = directive.group(1), directive.group(2).strip()
+            if keyword in ('if', 'ifdef', 'ifndef'):
+                if keyword == 'if':
+                    branch = evaluator.evaluate(argument) if state != 0 else 0
+                else:
+                    name = argument.split()[0] if argument else ''
+                    branch = int(defines[name] is not None) if name in defines else None
+                    if keyword == 'ifndef' and branch is not None:
+                        branch = int(not branch)
+                regions.append([state, branch, branch])
+                state = combineStates(state, branch)
+            elif keyword in ('elif', 'else') and regions:
+                parent_state, _, taken = regions[-1]
+                if taken == 1:
+                    branch = 0
+                elif keyword == 'elif':
+                    branch = evaluator.evaluate(argument) if parent_state != 0 else 0
+                    # After a branch that might have been taken this one is at best maybe
+                    if taken is None and branch == 1:
+                        branch = None
+                else:
+                    branch = 1 if taken == 0 else None
+                if taken != 1:
+                    taken = 1 if branch == 1 else (None if None in (taken, branch) else 0)
+                regions[-1] = [parent_state, branch, taken]
+                state = combineStates(parent_state, branch)
+                line_state = parent_state
+            elif keyword == 'endif' and regions:
+                state = regions.pop()[0]
+                line_state = state
+            elif keyword in ('define', 'undef') and state != 0:
+                definition = DEFINE_REGEX.match(argument)
+                if definition:
+                    name = definition.group(1)
+                    if state is None:
+                        defines.pop(name, None) # Might or might not be defined from here on
+                    elif keyword == 'undef':
+                        defines[name] = None
+                    else:
+                        # Function-like macros count as defined but their value isn't evaluated
+                        defines[name] = definition.group(3).strip() if not definition.group(2) else ''
+        if line_state == 0:
+            for j in range(start, i):
+                lines[j], line_in_comment = blankCode(lines[j], line_in_comment)
+            masked_lines += i - start
+    return ''.join(lines), masked_lines
@@ -0,0 +1,138 @@
+import os
+import sys
+import hashlib
+import pickle
+from antlr_build.CParser import CParser
+from antlr_build.CParser import serializedATN
+from antlr4.atn.ATNState import ATNState
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.SemanticContext import SemanticContext
+from antlr4.PredictionContext import PredictionContext
+from antlr4.PredictionContext import SingletonPredictionContext
+from antlr4.PredictionContext import ArrayPredictionContext
+from antlr4.dfa.DFA import DFA
+from antlr4.dfa.DFAState import DFAState
+
+# Bump this whenever the layout of the saved DFA changes
+DFA_CACHE_VERSION = 1
+
+def getGrammarHash():
+    # Saved DFA states refer to ATN state numbers, so they only fit the parser that built them
+    grammar_hash = hashlib.sha1(str(DFA_CACHE_VERSION).encode())
+    grammar_hash.update(repr(serializedATN()).encode())
+    return grammar_hash.hexdigest()
+
+class DFAPickler(pickle.Pickler):
+    # The runtime compares these singletons by identity, they must map back to the live objects
+    def persistent_id(self, obj):
+        if isinstance(obj, ATNState):
+            return ('atn_state', obj.stateNumber)
+        if obj is ATNSimulator.ERROR:
+            return ('error',)
+        if obj is PredictionContext.EMPTY:
+            return ('empty_context',)
+        if obj is SemanticContext.NONE:
+            return ('no_semantic_context',)
+        return None
+
+    def reducer_override(self, obj):
+        # Context hashes include hash(""), which changes between processes, so rebuild them on load
+        if type(obj) is SingletonPredictionContext:
+            return SingletonPredictionContext, (obj.parentCtx, obj.returnState)
+        if type(obj) is ArrayPredictionContext:
+            return ArrayPredictionContext, (obj.parents, obj.returnStates)
+        return NotImplemented
+
+class DFAUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid[0] == 'atn_state':
+            return CParser.atn.states[pid[1]]
+        if pid[0] == 'error':
+            return ATNSimulator.ERROR
+        if pid[0] == 'empty_context':
+            return PredictionContext.EMPTY
+        if pid[0] == 'no_semantic_context':
+            return SemanticContext.NONE
+        raise pickle.UnpicklingError(f"Unknown DFA cache reference {pid}")
+
+def flattenDFA(dfa):
+    # Edges become indices into a flat state list so long edge chains don't recurse in pickle
+    states = list(dfa._states.keys())
+    if dfa.s0 is not None and dfa.s0 not in dfa._states:
+        states.append(dfa.s0) # The start state of a precedence DFA isn't in _states
+    state_ids = {id(state): i for i, state in enumerate(states)}
+    records = []
+    for state in states:
+        edges = None
+        if state.edges is not None:
+            edges = [state_ids.get(id(target), target) for target in state.edges]
+        records.append((state.stateNumber, state.configs, edges, state.isAcceptState, state.prediction,
+                        state.requiresFullContext, state.predicates))
+    s0_id = state_ids[id(dfa.s0)] if dfa.s0 is not None else None
+    return dfa.decision, s0_id, len(dfa._states), records
+
+def unflattenDFA(decision, s0_id, state_count, records):
+    dfa = DFA(CParser.atn.decisionToState[decision], decision)
+    states = []
+    for state_number, configs, _, accept, prediction, full_context, predicates in records:
+        state = DFAState(state_number, configs)
+        configs.cachedHashCode = -1
+        state.isAcceptState = accept
+        state.prediction = prediction
+        state.requiresFullContext = full_context
+        state.predicates = predicates
+        states.append(state)
+    for state, record in zip(states, records):
+        if record[2] is not None:
+            state.edges = [states[target] if isinstance(target, int) else target for target in record[2]]
+    dfa._states = {state: state for state in states[:state_count]}
+    dfa.s0 = states[s0_id] if s0_id is not None else None
+    return dfa
+
+class DFACache():
+    # Keeps CParser's shared prediction DFA on disk so new processes start with a warm parser
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.grammar_hash = getGrammarHash()
+
+    def getStateCount(self):
+        return sum([len(dfa._states) for dfa in CParser.decisionsToDFA])
+
+    def load(self):
+        # Returns the number of DFA states loaded, a missing or stale cache loads nothing
+        if not os.path.exists(self.cache_path):
+            return 0
+        try:
+            with open(self.cache_path, 'rb') as f:
+                grammar_hash, flat_dfas = DFAUnpickler(f).load()
+        except Exception as e:
+            print(f"WARNING: could not read the DFA cache {self.cache_path} ({e}), starting cold.")
+            return 0
+        if grammar_hash != self.grammar_hash:
+            return 0
+        # The parser simulators hold on to this list, so it's updated in place
+        for flat_dfa in flat_dfas:
+            dfa = unflattenDFA(*flat_dfa)
+            CParser.decisionsToDFA[dfa.decision] = dfa
+        return self.getStateCount()
+
+    def save(self):
+        flat_dfas = [flattenDFA(dfa) for dfa in CParser.decisionsToDFA if dfa.s0 is not None]
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # Prediction contexts are nested one level per rule invocation
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, 20000))
+        # Write to a temporary file first so an interrupted run can't leave a partial cache
+        temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                DFAPickler(f, pickle.HIGHEST_PROTOCOL).dump((self.grammar_hash, flat_dfas))
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        os.replace(temp_path, self.cache_path)
+        return self.getStateCount()
+
+def warmWorkerDFA(cache_path):
+    # Pool initializer, forked workers already share the parent's DFA so only cold ones load
+    if cache_path is not None and not any([dfa._states for dfa in CParser.decisionsToDFA]):
+        DFACache(cache_path).load()
@@ -0,0 +1,16 @@
+import hashlib
+
+def countLines(data):
+    # Same count as iterating over the file in text mode (universal newlines)
+    lines_count = data.count(b'\n')
+    if b'\r' in data:
+        lines_count += data.count(b'\r') - data.count(b'\r\n')
+    if data and not data.endswith((b'\n', b'\r')):
+        lines_count += 1
+    return lines_count
+
+def readSourceFile(full_path):
+    # Single read of a source file, the regex pass and the parse cache share it
+    with open(full_path, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-8'), countLines(data), hashlib.sha1(data).hexdigest()
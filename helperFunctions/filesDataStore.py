@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import shutil
+import bisect
+from array import array
+import numpy as np
+import helperFunctions.nodesStructs as nodesStructs
+
+# Bump this whenever the layout of the saved columns changes
+FILES_DATA_VERSION = 2
+# FileNode attribute -> how its column is stored, rows are files sorted by name:
+#   int: one number per file            string: one string ID per file
+#   strings: string IDs per file        ints: numbers per file (array('i') attributes)
+#   counts: dict of string -> number    weights: dict of string -> one weight per DEPENDENCY_LAYERS
+#   pairs: dict of string -> string or None
+#   optional_strings: strings, None is kept apart from an empty list
+FILE_COLUMNS = {
+    'component': 'string',
+    'file_id': 'int',
+    'content_hash': 'string',
+    'include_paths': 'optional_strings',
+    'defines': 'pairs',
+    'mask_conditionals': 'int',
+    'masked_lines': 'int',
+    'lines_in_file': 'int',
+    'file_dependencies': 'counts',
+    'dependency_weights': 'weights',
+    'includes': 'strings',
+    'unresolved_includes': 'strings',
+    'file_dependents': 'counts',
+    'macro_candidates': 'strings',
+    'macro_dependencies': 'strings',
+    'other_dependencies': 'strings',
+    'macro_definitions': 'strings',
+    'macro_info': 'ints',
+    'macro_body_offsets': 'ints',
+    'macro_body_names': 'strings',
+    'other_definitions': 'strings',
+    'symbol_names': 'strings',
+    'symbol_edges': 'ints',
+    'antlr_errors': 'int',
+    'antlr_ll_fallback': 'int',
+    'budget_fallback': 'string',
+    'antlr_error_rules': 'counts',
+    'antlr_error_samples': 'strings'
+}
+
+class StringColumn():
+    # Read-only sequence over strings stored as one utf-8 buffer plus offsets,
+    # a string is only decoded when it's looked at (bisect only touches a few)
+    def __init__(self, buffer, offsets, ids=None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.ids = ids # Row -> string ID, None for every string of the table in order
+        self.decoded = None # String ID -> string, once decoded
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.ids is None else len(self.ids)
+
+    def __getitem__(self, i):
+        string_id = i if self.ids is None else self.ids[i]
+        return self.getString(string_id)
+
+    def getString(self, string_id):
+        return sys.intern(self.buffer[self.offsets[string_id]:self.offsets[string_id + 1]].tobytes().decode())
+
+    def getStrings(self, ids):
+        # Decodes every string not seen yet from one read of the buffer
+        if self.decoded is None:
+            self.decoded = [None] * (len(self.offsets) - 1)
+        ids = np.asarray(ids, dtype=np.int64)
+        new_ids = [string_id for string_id in np.unique(ids).tolist() if self.decoded[string_id] is None]
+        if new_ids:
+            starts = self.offsets[new_ids]
+            ends = self.offsets[np.array(new_ids) + 1]
+            first = starts.min()
+            data = self.buffer[first:ends.max()].tobytes()
+            for string_id, start, end in zip(new_ids, (starts - first).tolist(), (ends - first).tolist()):
+                self.decoded[string_id] = sys.intern(data[start:end].decode())
+        decoded = self.decoded
+        return [decoded[string_id] for string_id in ids.tolist()]
+
+def getPrefixRangesHelper(names, prefixes):
+    # Names are sorted, so the names under a prefix are one contiguous range of rows
+    ranges = []
+    for prefix in sorted(set(prefixes)):
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1)) if prefix else len(names)
+        # Overlapping prefixes ('ucp/', 'ucp/core/') are merged
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        elif start < end:
+            ranges.append((start, end))
+    return ranges
+
+def saveFilesData(files_dict, store_path, revision=None, link_resolution=0):
+    # One .npy per column and a single string table, written next to the old store
+    # and swapped in at the end so a crash can't leave a half-written store behind
+    # revision is the git commit the files were extracted from, None if they don't match one
+    # link_resolution is the mode the edges were counted with, incremental updates need the same one
+    files_list = [file for sub_dict in files_dict.values() for file in sub_dict.values()]
+    order = sorted(range(len(files_list)), key=lambda i: files_list[i].name)
+    sorted_files = [files_list[i] for i in order]
+    string_ids = {} # key = string, value = position in the string table
+
+    def getId(string):
+        return string_ids.setdefault(string, len(string_ids))
+
+    columns = {}
+    columns['name'] = np.array([getId(file.name) for file in sorted_files], dtype=np.int32)
+    # Position of each file in files_dict, the dict order is rebuilt from it when loading
+    columns['position'] = np.array(order, dtype=np.int32)
+    for field, kind in FILE_COLUMNS.items():
+        values = [getattr(file, field) for file in sorted_files]
+        if kind == 'int':
+            columns[field] = np.array(values, dtype=np.int64)
+            continue
+        if kind == 'string':
+            columns[field] = np.array([getId(value) for value in values], dtype=np.int32)
+            continue
+        if kind == 'optional_strings':
+            columns[f'{field}.none'] = np.array([value is None for value in values], dtype=np.bool_)
+            values = [value or () for value in values]
+        columns[f'{field}.offsets'] = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in values], out=columns[f'{field}.offsets'][1:])
+        if kind in ('strings', 'optional_strings'):
+            columns[field] = np.array([getId(string) for value in values for string in value], dtype=np.int32)
+        elif kind == 'ints':
+            columns[field] = np.array([number for value in values for number in value], dtype=np.int32)
+        else:
+            columns[f'{field}.keys'] = np.array([getId(key) for value in values for key in value], dtype=np.int32)
+            if kind == 'counts':
+                columns[field] = np.array([count for value in values for count in value.values()], dtype=np.int64)
+            elif kind == 'weights':
+                columns[field] = np.array([weights for value in values for weights in value.values()],
+                                          dtype=np.int64).reshape(-1, len(nodesStructs.DEPENDENCY_LAYERS))
+            else:
+                columns[field] = np.array([-1 if string is None else getId(string)
+                                           for value in values for string in value.values()], dtype=np.int32)
+
+    encoded = [string.encode() for string in string_ids]
+    columns['strings.offsets'] = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=columns['strings.offsets'][1:])
+    columns['strings'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    temp_path = f'{store_path}.{os.getpid()}.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for column, values in columns.items():
+        np.save(os.path.join(temp_path, f'{column}.npy'), values)
+    meta = {
+        'version': FILES_DATA_VERSION,
+        'source_dir': files_list[0].source_dir if files_list else '',
+        'run_dirs': list(files_dict),
+        'file_count': len(files_list),
+        'revision': revision,
+        'link_resolution': link_resolution,
+        'columns': FILE_COLUMNS
+    }
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    old_path = f'{store_path}.{os.getpid()}.old'
+    if os.path.exists(store_path):
+        os.replace(store_path, old_path)
+    os.replace(temp_path, store_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def loadFilesMeta(store_path):
+    # Store-wide information (source_dir, run_dirs, revision...) without reading any column
+    with open(os.path.join(store_path, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+def loadFilesData(store_path, prefixes=None):
+    # Returns files_dict, only with the files whose names start with one of prefixes if given
+    # Columns are memory-mapped, only the rows of the files loaded are read
+    meta = loadFilesMeta(store_path)
+    if meta['version'] != FILES_DATA_VERSION:
+        raise ValueError(f"{store_path} is from an unsupported version of the files data, run the analysis again.")
+
+    loaded_columns = {}
+
+    def loadColumn(column):
+        if column not in loaded_columns:
+            loaded_columns[column] = np.load(os.path.join(store_path, f'{column}.npy'), mmap_mode='r')
+        return loaded_columns[column]
+
+    strings = StringColumn(loadColumn('strings'), loadColumn('strings.offsets'))
+    names = StringColumn(strings.buffer, strings.offsets, loadColumn('name'))
+    if prefixes is None:
+        ranges = [(0, len(names))] if len(names) else []
+    else:
+        ranges = getPrefixRangesHelper(names, prefixes)
+    def splitHelper(values, offsets):
+        # Per-file slices of a column holding the values of every file in the range back to back
+        offsets = (offsets - offsets[0]).tolist()
+        return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    source_dir = meta['source_dir']
+    loaded_files = [] # (position, FileNode)
+    for start, end in ranges:
+        rows = {}
+        for field, kind in meta['columns'].items():
+            if kind in ('int', 'string'):
+                values = loadColumn(field)[start:end]
+                rows[field] = strings.getStrings(values) if kind == 'string' else values.tolist()
+                continue
+            offsets = loadColumn(f'{field}.offsets')[start:end + 1]
+            values = loadColumn(field)[offsets[0]:offsets[-1]]
+            if kind in ('strings', 'optional_strings'):
+                rows[field] = splitHelper(strings.getStrings(values), offsets)
+                if kind == 'optional_strings':
+                    rows[field] = [None if none else tuple(value) for value, none in
+                                   zip(rows[field], loadColumn(f'{field}.none')[start:end].tolist())]
+            elif kind == 'ints':
+                data = np.ascontiguousarray(values, dtype=np.int32).tobytes()
+                rows[field] = []
+                for file_data in splitHelper(data, offsets * values.itemsize):
+                    rows[field].append(array('i'))
+                    rows[field][-1].frombytes(file_data)
+            else:
+                keys = splitHelper(strings.getStrings(loadColumn(f'{field}.keys')[offsets[0]:offsets[-1]]), offsets)
+                if kind == 'pairs':
+                    values = [None if string_id == -1 else string for string_id, string in
+                              zip(values.tolist(), strings.getStrings(np.maximum(values, 0)))]
+                else:
+                    values = values.tolist()
+                rows[field] = [dict(zip(file_keys, file_values))
+                               for file_keys, file_values in zip(keys, splitHelper(values, offsets))]
+        positions = loadColumn('position')[start:end].tolist()
+        for i, file_name in enumerate(strings.getStrings(loadColumn('name')[start:end])):
+            # A joint file node skips reading the source, every attribute the store
+            # doesn't have (from a newer FileNode) keeps its default
+            file = nodesStructs.FileNode(source_dir, rows['component'][i], file_name, joint_file=1)
+            for field in rows:
+                if field in nodesStructs.FileNode.__slots__:
+                    value = rows[field][i]
+                    # Sequences come back as lists, keep the container types of the FileNode
+                    if type(value) == list and type(getattr(file, field)) == tuple:
+                        value = tuple(value)
+                    setattr(file, field, value)
+            loaded_files.append((positions[i], file))
+
+    # Same run_dir and file order as the files_dict that was saved
+    files_dict = {run_dir: {} for run_dir in meta['run_dirs']}
+    for _, file in sorted(loaded_files, key=lambda loaded_file: loaded_file[0]):
+        files_dict[file.component][file.name] = file
+    if prefixes is not None:
+        files_dict = {run_dir: sub_dict for run_dir, sub_dict in files_dict.items() if sub_dict}
+    return files_dict
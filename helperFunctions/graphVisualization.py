@@ -1,17 +1,14 @@
-import networkx as nx
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as path_effects
-import matplotlib.cm as cm
 import random
 from copy import deepcopy
-import matplotlib.colors as mcolors
 
 class GraphVisualization:
     def __init__(self):
         self.edges_list = []
+        self.edge_positions = {} # key = (a, b), value = position of the first a -> b edge in edges_list
         self.inbound_dependencies = {}
 
     def addEdge(self, a, b, c):
+        self.edge_positions.setdefault((a, b), len(self.edges_list))
         self.edges_list.append([a, b, c])
         # Track dependencies
         if b not in self.inbound_dependencies:
@@ -23,124 +20,95 @@ class GraphVisualization:
         return [nodes[i::k] for i in range(k)]
 
     def modular_quality(self, partition, graph, run_weighted_flag):
-        # Compute the modular quality (MQ) of a partition, bounded between -1 and 1
+        # Compute the modular quality (MQ) of a partition of the graph's node IDs, bounded between -1 and 1
         # MQ aims to maximize intraconnectivity and minimize interconnectivity
+        labels = graph.getLabels(partition)
+        matrix = graph.getClusterMatrix(labels, len(partition), run_weighted_flag)
+        sizes = [len(cluster) for cluster in partition]
+        return self.cluster_matrix_quality(matrix, sizes, graph.getTotalWeight(), run_weighted_flag)
+
+    def cluster_matrix_quality(self, matrix, sizes, total_weight, run_weighted_flag):
+        # MQ from the edges counted between each pair of clusters (see SparseGraph.getClusterMatrix)
 
         # Changes to MQ in order to add weighting
         if run_weighted_flag:
-            total_weight = sum(data['weight'] for _, _, data in graph.edges(data=True))
             if total_weight == 0:
                 return 0
+        matrix = matrix.tolist()
 
         # The connectivity within a cluster, bounded between 0 and 1
         # intra-edges / max intra-edge dependencies possible (modules^2)
-        def intraconnectivity(cluster):
-            intra_edges = 0
-            intra_modules = len(cluster)
-            for node in cluster:
-                for neighbor in graph.neighbors(node):
-                    if neighbor in cluster:
-                        intra_edges += 1
-            if intra_modules == 0:
-                return 1
-            return intra_edges / intra_modules**2
-        
-        def weighted_intraconnectivity(cluster):
-            intra_weight = 0
-            intra_modules = len(cluster)
-            for node in cluster:
-                for neighbor in graph.neighbors(node):
-                    if neighbor in cluster:
-                        intra_weight += graph[node][neighbor]['weight']
-            if intra_modules == 0:
+        def intraconnectivity(i):
+            if sizes[i] == 0:
                 return 1
-            return intra_weight / (total_weight * intra_modules)
+            if run_weighted_flag:
+                return matrix[i][i] / (total_weight * sizes[i])
+            return matrix[i][i] / sizes[i]**2
 
         # The connectivity between two clusters, bounded between 0 and 1
         # inter-edges / (2 * edges in i * edges in j)
-        def interconnectivity(cluster_i, cluster_j):
-            inter_edges = 0
-            nodes_i = len(cluster_i)
-            nodes_j = len(cluster_j)
-            if cluster_i != cluster_j:
-                # Edges from i to j
-                for node in cluster_i:
-                    for neighbor in graph.neighbors(node):
-                        if neighbor in cluster_j:
-                            inter_edges += 1
-                # Edges from j to i
-                for node in cluster_j:
-                    for neighbor in graph.neighbors(node):
-                        if neighbor in cluster_i:
-                            inter_edges += 1
-                if nodes_i == 0:
-                    return 1
-                elif nodes_j == 0:
-                    return 1
-                return inter_edges / (2 * nodes_i * nodes_j)
-            else:
-                return 0
-        
-        def weighted_interconnectivity(cluster_i, cluster_j):
-            inter_weight = 0
-            nodes_i = len(cluster_i)
-            nodes_j = len(cluster_j)
-            if cluster_i != cluster_j:
-                for node in cluster_i:
-                    for neighbor in graph.neighbors(node):
-                        if neighbor in cluster_j:
-                            inter_weight += graph[node][neighbor]['weight']
-                if nodes_i == 0 or nodes_j == 0:
-                    return 1
-                return inter_weight / (2 * nodes_i * nodes_j)
-            else:
+        def interconnectivity(i, j):
+            # Two empty clusters are the same cluster
+            if i == j or (sizes[i] == 0 and sizes[j] == 0):
                 return 0
+            if sizes[i] == 0 or sizes[j] == 0:
+                return 1
+            # The weighted version only counts the edges from i to j
+            if run_weighted_flag:
+                return matrix[i][j] / (2 * sizes[i] * sizes[j])
+            return (matrix[i][j] + matrix[j][i]) / (2 * sizes[i] * sizes[j])
 
         # mq = 1/k * (sum of inter - cluster const * (sum of intra))
         mq = 0
-        cluster_count = len(partition)
+        cluster_count = len(sizes)
         if cluster_count == 1:
             return 1
         if cluster_count == 0:
             return 0
         partition_constant = 1 / (cluster_count * (cluster_count - 1)) / 2
-        for cluster_i in partition:
-            if run_weighted_flag:
-                A_i = weighted_intraconnectivity(cluster_i)
-            else:
-                A_i = intraconnectivity(cluster_i)
+        for i in range(cluster_count):
+            A_i = intraconnectivity(i)
             E_i_j = 0
-            for cluster_j in partition:
-                if run_weighted_flag:
-                    E_i_j += weighted_interconnectivity(cluster_i, cluster_j)
-                else:
-                    E_i_j += interconnectivity(cluster_i, cluster_j)
+            for j in range(cluster_count):
+                E_i_j += interconnectivity(i, j)
             mq += A_i - (partition_constant * E_i_j)
         mq = (1 / cluster_count) * mq
         return mq
 
     def find_better_partition(self, current_partition, graph, run_weighted_flag):
         # Find a better neighboring partition by moving a node to a different cluster.
-        best_partition = current_partition
-        best_mq = self.modular_quality(current_partition, graph, run_weighted_flag)
+        # Each move only updates the cluster matrix with the moved node's edges
+        labels = graph.getLabels(current_partition)
+        matrix = graph.getClusterMatrix(labels, len(current_partition), run_weighted_flag)
+        sizes = [len(cluster) for cluster in current_partition]
+        total_weight = graph.getTotalWeight()
+        best_move = None
+        best_mq = self.cluster_matrix_quality(matrix, sizes, total_weight, run_weighted_flag)
 
         for i, cluster in enumerate(current_partition):
             for node in cluster:
                 # Attempt to move node to every other cluster
                 for j, target_cluster in enumerate(current_partition):
                     if i != j:
-                        new_partition = deepcopy(current_partition)
-                        new_partition[i].remove(node)
-                        new_partition[j].append(node)
-                        new_mq = self.modular_quality(new_partition, graph, run_weighted_flag)
+                        new_matrix = graph.moveNode(matrix, labels, node, i, j, run_weighted_flag)
+                        new_sizes = list(sizes)
+                        new_sizes[i] -= 1
+                        new_sizes[j] += 1
+                        new_mq = self.cluster_matrix_quality(new_matrix, new_sizes, total_weight, run_weighted_flag)
                         if new_mq > best_mq:
-                            best_partition = new_partition
+                            best_move = (i, node, j)
                             best_mq = new_mq
-        return best_partition if best_partition != current_partition else None
+        if best_move is None:
+            return None
+        i, node, j = best_move
+        best_partition = deepcopy(current_partition)
+        best_partition[i].remove(node)
+        best_partition[j].append(node)
+        return best_partition
 
     def sub_optimal_clustering(self, graph, k, run_weighted_flag):
         # Initialize the clustering state
-        nodes = list(graph.nodes)
+        nodes = list(range(graph.getNodeCount()))
         partition = self.generate_random_partition(nodes, k)
 
         while True:
@@ -153,7 +121,7 @@ class GraphVisualization:
 
     def genetic_clustering(self, graph, k, run_weighted_flag, population_size=10, max_generations=100):
         # Initialize the clustering state
-        nodes = list(graph.nodes)
+        nodes = list(range(graph.getNodeCount()))
         population = [self.generate_random_partition(nodes, k) for _ in range(population_size)]
 
         for generation in range(max_generations):
@@ -185,14 +153,13 @@ class GraphVisualization:
         return [self.modular_quality(best_partition, graph, run_weighted_flag), best_partition]
 
     def find_isolated_branches(self, graph):
-        connected_components = nx.connected_components(graph)
-        return [list(component) for component in connected_components]
+        return graph.getConnectedComponents()
 
     def visualize(self, clustering_method, k, graph_file_name, random_samples, gen_plot, color_by_dependencies):
         # K is the number of clusters that will be generated
-        # Initialize the graph
-        my_graph = nx.Graph()
-        my_graph.add_edges_from([[a, b, {'weight': c}] for a,b,c in self.edges_list])
+        # Initialize the graph, the clustering works on integer node IDs
+        from helperFunctions.sparseGraph import SparseGraph
+        my_graph = SparseGraph(self.edges_list)
         dynamic_k = 0
         if k == 0:
             dynamic_k = 1
@@ -200,7 +167,7 @@ class GraphVisualization:
         # First find any isolated clusters
         isolated_clusters = self.find_isolated_branches(my_graph)
         if not isolated_clusters:
-            isolated_clusters = [my_graph.nodes()]
+            isolated_clusters = [list(range(my_graph.getNodeCount()))]
 
         # Process each isolated cluster separately
         all_clusters = []
@@ -251,7 +218,7 @@ class GraphVisualization:
                 clusters = best_clusters
             
             # Append the clusters found in the subgraph to the overall list
-            all_clusters.extend(clusters)
+            all_clusters.extend([[subgraph.nodes[node] for node in cluster] for cluster in clusters])
             mq_values.append(mq_value)
         
         mq_mean = sum(mq_values) / len(isolated_clusters)
@@ -269,6 +236,16 @@ class GraphVisualization:
         if not gen_plot:
             return [mq_mean, clusters_colored]
 
+        # matplotlib is only loaded when a plot is actually drawn
+        import matplotlib.pyplot as plt
+        import matplotlib.patheffects as path_effects
+        import matplotlib.cm as cm
+        import matplotlib.colors as mcolors
+        # networkx is only used for the layout and drawing
+        import networkx as nx
+        my_graph = nx.Graph()
+        my_graph.add_edges_from([[a, b, {'weight': c}] for a,b,c in self.edges_list])
+
         # Position the nodes in a circular layout
         pos = nx.circular_layout(my_graph)
 
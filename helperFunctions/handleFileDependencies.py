@@ -1,54 +1,27 @@
 import os
+import time
+import random
+import multiprocessing
 import helperFunctions.nodesStructs as nodesStructs
-from contextlib import redirect_stderr
+from helperFunctions.symbolIndex import SymbolIndex
+from helperFunctions.includeResolver import getIncludeResolver
+from helperFunctions.fileIngestion import readSourceFile
+from contextlib import redirect_stdout
 
-def reconstrainFileReferences(run_dirs, files_dict, constraint):
-    files_list = [file for sub_dict in files_dict.values() for file in sub_dict.values()]
-    # Reset the file dependencies
-    for file_i in files_list:
+def reconstrainFileReferences(files_dict, constraint):
+    # Switch every edge to another view of the weight layers computed during extraction
+    file_index = nodesStructs.FileIndex(files_dict)
+    for file_i in file_index.files:
         file_i.resetDependencies()
-    # Cross-compare the files to get inter-file dependencies
-    for file_i in files_list:
-        file_dependencies = file_i.file_dependencies
-        for file_j_key in file_dependencies:
-            file_j = ''
-            # Get the object
-            for run_dir in run_dirs:
-                if file_j_key in files_dict[run_dir]:
-                    file_j = files_dict[run_dir][file_j_key]
-            if file_j == '':
-                continue
-            # Check macro dependencies
-            if constraint == 'macros':
-                for macro in file_i.macro_dependencies:
-                    if macro in file_j.macro_definitions:
-                        file_dependencies[file_j_key] += 1
-            # Check function dependencies
-            if constraint == 'functions':
-                for other in file_i.other_dependencies:
-                    if other in file_j.other_definitions:
-                        file_dependencies[file_j_key] += 1
-
-def crossReferenceFiles(files_list, run_dirs, files_dict):
-    # Cross-compare the files to get inter-file dependencies
+        file_i.applyDependencyView(constraint)
+    for file_i in file_index.files:
+        file_i.shareDependencies(file_index)
+
+def crossReferenceFiles(files_list, symbol_index):
+    # Look up every use in the symbol index to get the weight layers of each dependency
     for file_i in files_list:
-        file_dependencies = file_i.file_dependencies
-        for file_j_key in file_dependencies:
-            file_j = ''
-            # Get the object
-            for run_dir in run_dirs:
-                if file_j_key in files_dict[run_dir]:
-                    file_j = files_dict[run_dir][file_j_key]
-            if file_j == '':
-                continue
-            # Check macro dependencies
-            for macro in file_i.macro_dependencies:
-                if macro in file_j.macro_definitions:
-                    file_dependencies[file_j_key] += 1
-            # Check function dependencies
-            for other in file_i.other_dependencies:
-                if other in file_j.other_definitions:
-                    file_dependencies[file_j_key] += 1
+        symbol_index.countLayeredUses(file_i)
+        file_i.applyDependencyView('all')
 
 def getCAndHFilesHelper(directory):
     # Helper function to get a list of .c and .h files in a directory
@@ -59,36 +32,233 @@ def getCAndHFilesHelper(directory):
                 c_and_h_files.append(os.path.join(root, file))
     return c_and_h_files
 
-def getFileDependencies(source_dir, run_dirs, antlr_err_outputs):
+def antlrWorkerHelper(task):
+    # Runs inside a pool worker, only the symbol lists and error counts are sent back
+    # The file is read by the task itself, so only the files being parsed are in memory
+    from helperFunctions.antlrExtraction import extractAntlrSymbols
+    file_index, full_path, defines, antlr_options = task
+    source_text, content_hash = nodesStructs.readSourceText(full_path, defines)
+    return file_index, content_hash, extractAntlrSymbols(source_text, **antlr_options)
+
+def runAntlrExtraction(files_list, jobs, antlr_options, dfa_cache=None, dfa_warmup=0):
+    # Returns the files that changed on disk since their regex pass
+    tasks = [(i, file.full_path, file.defines if file.mask_conditionals else None, antlr_options)
+             for i, file in enumerate(files_list)]
+    changed_files = []
+
+    def applyHelper(file_index, content_hash, results):
+        files_list[file_index].applyAntlrResults(results)
+        if content_hash != files_list[file_index].content_hash:
+            changed_files.append(files_list[file_index])
+
+    serial_tasks = tasks
+    if jobs > 1:
+        # Parse a sample in this process first so every worker starts with the warmed DFA
+        # The workers' states are never merged back, so a DFA cache is only updated from this
+        # sample, it gets one file per worker when no size was asked for
+        if not dfa_warmup and dfa_cache is not None:
+            dfa_warmup = jobs
+        serial_tasks = random.Random(0).sample(tasks, min(dfa_warmup, len(tasks)))
+    for task in serial_tasks:
+        applyHelper(*antlrWorkerHelper(task))
+    # Only the states built in this process (all files with one job, the warm-up sample otherwise)
+    if dfa_cache is not None and serial_tasks:
+        print(f"Saved {dfa_cache.save()} parser DFA states to {dfa_cache.cache_path}.")
+    if jobs > 1:
+        warmed_files = set([task[0] for task in serial_tasks])
+        tasks = [task for task in tasks if task[0] not in warmed_files]
+        # Hand the largest files out first so a single big file doesn't finish last
+        tasks.sort(key=lambda task: files_list[task[0]].lines_in_file, reverse=True)
+        from helperFunctions.dfaCache import warmWorkerDFA
+        cache_path = dfa_cache.cache_path if dfa_cache is not None else None
+        with multiprocessing.Pool(jobs, initializer=warmWorkerDFA, initargs=(cache_path,)) as pool:
+            for file_index, content_hash, results in pool.imap_unordered(antlrWorkerHelper, tasks):
+                applyHelper(file_index, content_hash, results)
+    return changed_files
+
+def writeErrorReports(files_dict, rule_outputs, library_outputs):
+    # Syntax error rates straight from the per-file counts, no log parsing needed
+    rule_errors = {} # key = grammar rule, value = [# of errors, # of files]
+    with open(library_outputs, 'w') as f:
+        with redirect_stdout(f):
+            print("library,files,lines_of_code,syntax_errors,files_with_errors,errors_per_kloc")
+            for run_dir, sub_dict in files_dict.items():
+                lines_of_code = sum([file.lines_in_file for file in sub_dict.values()])
+                syntax_errors = sum([file.antlr_errors for file in sub_dict.values()])
+                files_with_errors = len([file for file in sub_dict.values() if file.antlr_errors])
+                errors_per_kloc = 1000 * syntax_errors / lines_of_code if lines_of_code else 0
+                print(f"{run_dir},{len(sub_dict)},{lines_of_code},{syntax_errors},{files_with_errors},{errors_per_kloc:.3f}")
+                for file in sub_dict.values():
+                    for rule, count in file.antlr_error_rules.items():
+                        rule_errors.setdefault(rule, [0, 0])
+                        rule_errors[rule][0] += count
+                        rule_errors[rule][1] += 1
+    with open(rule_outputs, 'w') as f:
+        with redirect_stdout(f):
+            print("rule,syntax_errors,files")
+            for rule, (count, files) in sorted(rule_errors.items(), key=lambda item: -item[1][0]):
+                print(f"{rule},{count},{files}")
+
+def compareExtractors(files_list, sample_size, comparison_outputs, antlr_options):
+    # Measure how closely the token extractor matches ANTLR on a random sample of files
+    from helperFunctions.antlrExtraction import extractAntlrSymbols
+    sample = random.Random(0).sample(files_list, min(sample_size, len(files_list)))
+    categories = ('other_definitions', 'other_dependencies', 'macro_dependencies')
+    matches = {category: [0, 0, 0] for category in categories} # [common, tokens, antlr]
+    extractor_times = {'antlr': 0, 'tokens': 0}
+    for file in sample:
+        source_text = readSourceFile(file.full_path)[0]
+        results = {}
+        for extractor in extractor_times.keys():
+            start_time = time.perf_counter()
+            results[extractor] = extractAntlrSymbols(source_text, **dict(antlr_options, extractor=extractor))
+            extractor_times[extractor] += time.perf_counter() - start_time
+        for category in categories:
+            antlr_symbols = set(results['antlr'][category])
+            token_symbols = set(results['tokens'][category])
+            matches[category][0] += len(antlr_symbols & token_symbols)
+            matches[category][1] += len(token_symbols)
+            matches[category][2] += len(antlr_symbols)
+    with open(comparison_outputs, 'w') as f:
+        with redirect_stdout(f):
+            print("category,common,tokens_found,antlr_found,precision,recall")
+            for category, (common, token_count, antlr_count) in matches.items():
+                precision = common / token_count if token_count else 1
+                recall = common / antlr_count if antlr_count else 1
+                print(f"{category},{common},{token_count},{antlr_count},{precision:.3f},{recall:.3f}")
+            print(f"antlr_seconds,{extractor_times['antlr']:.3f}")
+            print(f"tokens_seconds,{extractor_times['tokens']:.3f}")
+    print(f"Compared extractors on {len(sample)} files, token extraction took "
+          f"{extractor_times['tokens']:.2f}s vs {extractor_times['antlr']:.2f}s for ANTLR.")
+
+def extractAntlrData(files_list, jobs=1, parse_cache=None, antlr_options=None, dfa_cache=None, dfa_warmup=0):
+    # Fill in the ANTLR data of files that went through the regex pass
+    if antlr_options is None:
+        antlr_options = {}
+    files_to_parse = files_list
+    # Only files whose content changed since the last run need to be parsed
+    if parse_cache is not None:
+        parse_cache.resetCounts()
+        files_to_parse = []
+        for file in files_list:
+            entry = parse_cache.load(file)
+            if entry is None:
+                files_to_parse.append(file)
+        print(f"Parse cache: {parse_cache.hits} hits, {parse_cache.misses} misses.")
+    changed_files = runAntlrExtraction(files_to_parse, jobs, antlr_options, dfa_cache, dfa_warmup)
+    for file in changed_files:
+        print(f"WARNING: {file.name} changed while it was being analysed, its results aren't cached.")
+    if parse_cache is not None:
+        for file in files_to_parse:
+            if file not in changed_files:
+                parse_cache.store(file)
+    for file in files_list:
+        if file.budget_fallback:
+            print(f"WARNING: {file.name} went over the {file.budget_fallback} budget, symbols were approximated from tokens.")
+
+def writeErrorLog(files_list, antlr_err_outputs):
+    # Only a sample of each file's messages is kept, the counts are in the error reports
+    with open(antlr_err_outputs, 'w') as f:
+        for file in files_list:
+            for sample in file.antlr_error_samples:
+                f.write(f"{file.name}: {sample}\n")
+            error_count = sum(file.antlr_error_rules.values())
+            if error_count > len(file.antlr_error_samples):
+                f.write(f"{file.name}: ... {error_count - len(file.antlr_error_samples)} more\n")
+
+def getRunDirHelper(file_name, run_dirs):
+    # Returns the run directory a file belongs to, or None if it's outside all of them
+    for run_dir in run_dirs:
+        if file_name.startswith(run_dir.rstrip('/') + '/'):
+            return run_dir
+    return None
+
+def collectTranslationUnitFiles(source_dir, run_dirs, translation_units, include_resolver,
+                                include_paths, files_dict, defines=None):
+    # Start from the compiled files and follow their includes so headers get the
+    # include paths and defines of a translation unit that actually uses them
+    pending_files = []
+    for unit in translation_units:
+        file_name = unit['file'].replace(source_dir, "")
+        run_dir = getRunDirHelper(file_name, run_dirs)
+        if run_dir is None or file_name in files_dict[run_dir]:
+            continue
+        unit_defines = unit['defines']
+        if defines is not None:
+            # Defines given on the command line win over the compile command's
+            unit_defines = dict(unit_defines, **defines)
+        pending_files.append((run_dir, file_name, unit['include_paths'] + tuple(include_paths),
+                              unit_defines))
+    while pending_files:
+        run_dir, file_name, unit_include_paths, unit_defines = pending_files.pop()
+        if file_name in files_dict[run_dir] or not os.path.isfile(source_dir + file_name):
+            continue
+        file_object = nodesStructs.FileNode(source_dir, run_dir, file_name,
+                                            include_resolver=include_resolver,
+                                            include_paths=unit_include_paths,
+                                            defines=unit_defines,
+                                            mask_conditionals=defines is not None)
+        files_dict[run_dir][file_object.name] = file_object
+        # Queue the headers each file pulls in, every file is only processed once
+        for dependency in file_object.file_dependencies:
+            dependency_run_dir = getRunDirHelper(dependency, run_dirs)
+            if dependency_run_dir is not None and dependency not in files_dict[dependency_run_dir]:
+                pending_files.append((dependency_run_dir, dependency, unit_include_paths, unit_defines))
+
+def getFileDependencies(source_dir, run_dirs, antlr_err_outputs, jobs=1, parse_cache=None, antlr_options=None,
+                        include_paths=(), translation_units=None, dfa_cache=None, dfa_warmup=0, defines=None,
+                        link_resolution=0, include_resolver=None):
     # Get the file data for every file in the source directory
     # Files will be hashed based on the run directories
+    if antlr_options is None:
+        antlr_options = {}
     files_dict = {}
+    if include_resolver is None:
+        include_resolver = getIncludeResolver(source_dir, include_paths)
     
     # Do a preliminary pass of every file to get their names
     # Also collects pre-processor statements (include files and defined macros)
+    # When defines are given, #if branches that are inactive for them are masked out first
     for run_dir in run_dirs:
         files_dict[run_dir] = {}
-        component_directory = source_dir + run_dir
-        files_list = getCAndHFilesHelper(component_directory)
-        # Get the data for each file
-        for file in files_list:
-            file_name = file.replace(source_dir, "")
-            file_object = nodesStructs.FileNode(source_dir, run_dir, file_name)
-            files_dict[run_dir][file_name] = file_object
+    if translation_units is not None:
+        collectTranslationUnitFiles(source_dir, run_dirs, translation_units, include_resolver,
+                                    include_paths, files_dict, defines)
+    else:
+        for run_dir in run_dirs:
+            component_directory = source_dir + run_dir
+            files_list = getCAndHFilesHelper(component_directory)
+            # Get the data for each file
+            for file in files_list:
+                file_name = file.replace(source_dir, "")
+                file_object = nodesStructs.FileNode(source_dir, run_dir, file_name,
+                                                    include_resolver=include_resolver,
+                                                    defines=defines if defines is not None else {},
+                                                    mask_conditionals=defines is not None)
+                files_dict[run_dir][file_name] = file_object
     
     # Get the remainder of intra-file data using ANTLR
     print("Extracting ANTLR data.")
     all_files = [file for sub_dict in files_dict.values() for file in sub_dict.values()]
-    with open(antlr_err_outputs, 'w') as f:
-        with redirect_stderr(f):
-            for file in all_files:
-                file.getAntlrDependencies()
+    extractAntlrData(all_files, jobs, parse_cache, antlr_options, dfa_cache, dfa_warmup)
+    writeErrorLog(all_files, antlr_err_outputs)
+    if antlr_options.get('two_stage_parse'):
+        ll_fallbacks = len([file for file in all_files if file.antlr_ll_fallback])
+        print(f"SLL parse failed and fell back to LL for {ll_fallbacks} of {len(all_files)} files.")
+    if defines is not None:
+        masked_lines = sum([file.masked_lines for file in all_files])
+        print(f"Masked {masked_lines} lines of inactive conditional regions.")
     print("ANTLR data extraction complete.")
 
     # Get the dependencies between the files
-    crossReferenceFiles(all_files, run_dirs, files_dict)
+    symbol_index = SymbolIndex(all_files, link_resolution)
+    crossReferenceFiles(all_files, symbol_index)
+    if link_resolution:
+        linked_edges = sum([len([w for w in file.dependency_weights.values() if not w[2]]) for file in all_files])
+        print(f"Linked {linked_edges} dependencies to files that aren't included.")
+    file_index = nodesStructs.FileIndex(files_dict)
     for file in all_files:
-        file.shareDependencies(run_dirs, files_dict)
+        file.shareDependencies(file_index)
     
     return files_dict
 
@@ -0,0 +1,68 @@
+import os
+import sys
+
+def getIncludeResolver(source_dir, search_paths=()):
+    # A new index of the tree as it is now, one run shares it between all of its FileNodes
+    # and keeps it in sync with updateFile instead of the index living as long as the process
+    return IncludeResolver(source_dir, tuple(search_paths))
+
+class IncludeResolver():
+    # Resolves #include strings against an in-memory index of the tree instead of the filesystem
+    def __init__(self, source_dir, search_paths=()):
+        self.source_dir = source_dir
+        self.search_paths = tuple(os.path.abspath(path) for path in search_paths)
+        self.tree_files = {} # key = normalized absolute path, value = file name relative to source_dir
+        self.indexed_roots = []
+        self.resolved = {} # key = (including directory, include string, search paths), value = file name or None
+        for directory in (source_dir,) + self.search_paths:
+            self.indexDirectory(directory)
+
+    def indexDirectory(self, directory):
+        # One walk per search root, symlinks are only resolved once per file here
+        directory = os.path.abspath(directory)
+        if any([directory == root or directory.startswith(root + os.sep) for root in self.indexed_roots]):
+            return
+        self.indexed_roots.append(directory)
+        visited_dirs = set()
+        for root, dirs, files in os.walk(directory, followlinks=True):
+            real_root = os.path.realpath(root)
+            if real_root in visited_dirs:
+                dirs[:] = []
+                continue
+            visited_dirs.add(real_root)
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for file in files:
+                path = os.path.join(root, file)
+                if path not in self.tree_files:
+                    relative_path = os.path.realpath(path).replace(self.source_dir, "")
+                    self.tree_files[path] = sys.intern(relative_path)
+
+    def updateFile(self, path, exists):
+        # Keep the index in sync with files added or deleted after it was built
+        path = os.path.abspath(path)
+        if exists:
+            self.tree_files[path] = sys.intern(os.path.realpath(path).replace(self.source_dir, ""))
+        else:
+            self.tree_files.pop(path, None)
+        self.resolved = {}
+
+    def resolve(self, including_dir, include_file, search_paths=None):
+        # Same search order as before: source_dir, the including file's directory, then -I paths
+        # Translation units with their own -I flags pass them in as search_paths
+        if search_paths is None:
+            search_paths = self.search_paths
+        key = (including_dir, include_file, search_paths)
+        if key not in self.resolved:
+            self.resolved[key] = None
+            for base_dir in (self.source_dir, including_dir) + search_paths:
+                path = os.path.normpath(os.path.join(os.path.abspath(base_dir), include_file))
+                if path in self.tree_files:
+                    self.resolved[key] = self.tree_files[path]
+                    break
+                # Search paths outside the indexed tree are indexed the first time they're used
+                if base_dir in search_paths and base_dir not in self.indexed_roots:
+                    self.indexDirectory(base_dir)
+                    if path in self.tree_files:
+                        self.resolved[key] = self.tree_files[path]
+                        break
+        return self.resolved[key]
@@ -0,0 +1,170 @@
+import os
+import subprocess
+import helperFunctions.nodesStructs as nodesStructs
+from helperFunctions.symbolIndex import SymbolIndex
+from helperFunctions.includeResolver import getIncludeResolver
+from helperFunctions.handleFileDependencies import extractAntlrData
+from helperFunctions.handleFileDependencies import writeErrorLog
+from helperFunctions.handleFileDependencies import getRunDirHelper
+
+def runGitHelper(source_dir, arguments):
+    result = subprocess.run(['git', '-C', source_dir] + arguments, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(arguments)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+def getRevision(source_dir, revision):
+    # Full commit hash of a revision name (HEAD, a branch, a tag...)
+    return runGitHelper(source_dir, ['rev-parse', '--verify', f'{revision}^{{commit}}']).strip()
+
+def getTreeRevision(source_dir):
+    # Commit the files on disk were checked out from, None if tracked files under source_dir
+    # have been edited since (or source_dir isn't in a git repository)
+    try:
+        if runGitHelper(source_dir, ['status', '--porcelain', '--untracked-files=no', '--', '.']):
+            return None
+        return getRevision(source_dir, 'HEAD')
+    except (RuntimeError, OSError):
+        return None
+
+def getChangedFiles(source_dir, rev_a, rev_b=None):
+    # Files changed between two revisions, or between a revision and the working tree
+    # Returns key = path relative to source_dir, value = A (added), M (modified) or D (deleted)
+    # A rename is a delete of the old path and an add of the new one
+    arguments = ['diff', '--name-status', '--relative', '-M', rev_a]
+    if rev_b is not None:
+        arguments.append(rev_b)
+        # The files are read from disk, so the checkout has to be at rev_b
+        if runGitHelper(source_dir, ['diff', '--name-only', '--relative', rev_b]):
+            print(f"WARNING: the working tree doesn't match {rev_b}, the files on disk are analysed.")
+    changed_files = {}
+    for line in runGitHelper(source_dir, arguments).splitlines():
+        fields = line.split('\t')
+        status = fields[0][0]
+        if status == 'R':
+            changed_files[fields[1]] = 'D'
+            changed_files[fields[2]] = 'A'
+        elif status in ('A', 'C'):
+            changed_files[fields[-1]] = 'A'
+        elif status == 'D':
+            changed_files[fields[1]] = 'D'
+        else:
+            changed_files[fields[-1]] = 'M'
+    # New files the working tree has that git doesn't track yet
+    if rev_b is None:
+        for path in runGitHelper(source_dir, ['ls-files', '--others', '--exclude-standard']).splitlines():
+            changed_files[path] = 'A'
+    return changed_files
+
+def updateFileDependencies(files_dict, changed_files, source_dir, run_dirs, antlr_err_outputs, jobs=1,
+                           parse_cache=None, antlr_options=None, include_paths=(), translation_units=None,
+                           dfa_cache=None, dfa_warmup=0, defines=None, symbol_index=None,
+                           link_resolution=0, include_resolver=None):
+    # Patch the files data of an earlier run with the changed files only
+    # A symbol index and include resolver kept from an earlier update are patched along with it
+    # Returns the names of every file whose data or edges changed (deleted files included)
+    if include_resolver is None:
+        include_resolver = getIncludeResolver(source_dir, include_paths)
+    file_index = nodesStructs.FileIndex(files_dict)
+    if symbol_index is None:
+        symbol_index = SymbolIndex(file_index.files, link_resolution)
+    # Flags of the compiled files, headers keep the flags of the run they were found in
+    unit_flags = {}
+    for unit in translation_units or ():
+        unit_defines = unit['defines'] if defines is None else dict(unit['defines'], **defines)
+        unit_flags[unit['file'].replace(source_dir, "")] = (unit['include_paths'] + tuple(include_paths), unit_defines)
+
+    for path, status in changed_files.items():
+        if status != 'M':
+            include_resolver.updateFile(os.path.join(source_dir, path), status == 'A')
+
+    # Take the old version of every changed file out of the index
+    old_macros = set(symbol_index.macro_definers)
+    changed_names = set()
+    new_files = []
+    for path, status in changed_files.items():
+        file_name = os.path.join(source_dir, path).replace(source_dir, "")
+        run_dir = getRunDirHelper(file_name, run_dirs)
+        old_file = file_index.get(file_name)
+        if old_file is not None:
+            symbol_index.removeFile(old_file)
+            del files_dict[old_file.component][file_name]
+            for dependency in old_file.file_dependencies:
+                dependency_obj = file_index.get(dependency)
+                if dependency_obj is not None:
+                    dependency_obj.file_dependents.pop(file_name, None)
+            changed_names.add(old_file.name)
+        if status == 'D' or run_dir is None or not file_name.endswith(('.c', '.h', '.inl')):
+            continue
+        if not os.path.isfile(source_dir + file_name):
+            continue
+        if old_file is not None:
+            file_include_paths, file_defines = old_file.include_paths, old_file.defines
+        elif file_name in unit_flags:
+            file_include_paths, file_defines = unit_flags[file_name]
+        elif translation_units is not None:
+            file_include_paths, file_defines = tuple(include_paths), defines if defines is not None else {}
+        else:
+            file_include_paths, file_defines = None, defines if defines is not None else {}
+        file_object = nodesStructs.FileNode(source_dir, run_dir, file_name,
+                                            include_resolver=include_resolver,
+                                            include_paths=file_include_paths,
+                                            defines=file_defines,
+                                            mask_conditionals=defines is not None)
+        # Files including this one haven't changed, their edges are recounted below
+        if old_file is not None:
+            file_object.file_dependents = old_file.file_dependents
+        files_dict[run_dir][file_object.name] = file_object
+        changed_names.add(file_object.name)
+        new_files.append(file_object)
+
+    print(f"Extracting ANTLR data for {len(new_files)} changed files.")
+    extractAntlrData(new_files, jobs, parse_cache, antlr_options, dfa_cache, dfa_warmup)
+    for file in new_files:
+        symbol_index.addFile(file)
+    file_index = nodesStructs.FileIndex(files_dict)
+    writeErrorLog(file_index.files, antlr_err_outputs)
+
+    # Includes of unchanged files can point to a deleted file or to a file that was just added
+    affected_names = set(changed_names)
+    recount_names = set()
+    for file in file_index.files:
+        if file.name in changed_names:
+            continue
+        if file.unresolved_includes or any([dependency in changed_names for dependency in file.dependency_weights]):
+            old_dependencies = set(file.dependency_weights)
+            file.resolveIncludes(include_resolver)
+            for dependency in old_dependencies - set(file.dependency_weights):
+                dependency_obj = file_index.get(dependency)
+                if dependency_obj is not None:
+                    dependency_obj.file_dependents.pop(file.name, None)
+            if old_dependencies != set(file.dependency_weights):
+                affected_names.add(file.name)
+            elif old_dependencies & changed_names:
+                recount_names.add(file.name)
+
+    # Only the edges touching a changed file need their weights counted again,
+    # with link resolution any file can use a symbol a changed file defines
+    recount_files = [file for file in file_index.files if symbol_index.link_resolution or
+                     file.name in affected_names or file.name in recount_names]
+    for file in recount_files:
+        old_weights = {dependency: list(weights) for dependency, weights in file.dependency_weights.items()}
+        symbol_index.countLayeredUses(file)
+        file.applyDependencyView('all')
+        for dependency in set(old_weights) - set(file.dependency_weights):
+            dependency_obj = file_index.get(dependency)
+            if dependency_obj is not None:
+                dependency_obj.file_dependents.pop(file.name, None)
+        if file.dependency_weights != old_weights:
+            affected_names.add(file.name)
+    # A macro defined or undefined by a changed file adds or drops uses in the files not recounted
+    if old_macros.symmetric_difference(symbol_index.macro_definers):
+        recounted_names = {file.name for file in recount_files}
+        for file in file_index.files:
+            if file.name not in recounted_names:
+                symbol_index.filterMacroUses(file)
+    for file in file_index.files:
+        if file.name in affected_names:
+            file.shareDependencies(file_index)
+    print(f"Updated {len(changed_names)} changed files, {len(affected_names - changed_names)} other files had edges re-weighted.")
+    return affected_names
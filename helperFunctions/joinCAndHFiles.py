@@ -1,4 +1,3 @@
-import os
 import helperFunctions.nodesStructs as nodesStructs
 
 def joinCAndHFiles(files_dict, source_dir):
@@ -18,12 +17,12 @@ def joinCAndHFiles(files_dict, source_dir):
                 files_list.append(h_file)
                 file_c_name = file_root + ".c"
                 file_inl_name = file_root + ".inl"
-                # Check if the .c file exists
-                if os.path.exists(os.path.join(source_dir, file_c_name)):
+                # Check if the .c file was analysed (with compile_commands.json not every file on disk is)
+                if file_c_name in files_dict[run_dir]:
                     seen_files.append(file_c_name)
                     files_list.append(files_dict[run_dir][file_c_name])
-                # Check if the .inl file exists
-                if os.path.exists(os.path.join(source_dir, file_inl_name)):
+                # Check if the .inl file was analysed
+                if file_inl_name in files_dict[run_dir]:
                     seen_files.append(file_inl_name)
                     files_list.append(files_dict[run_dir][file_inl_name])
                 if len(files_list) < 2:
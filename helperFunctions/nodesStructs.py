@@ -1,33 +1,144 @@
 import re
 import os
-# ANTLR packages
-from antlr_build.CLexer import CLexer
-from antlr_build.CParser import CParser
-from helperFunctions.ModuleExtractionListener import ModuleExtractionListener
-from antlr4 import *
+import sys
+from array import array
+from helperFunctions.includeResolver import getIncludeResolver
+from helperFunctions.fileIngestion import readSourceFile
+from helperFunctions.conditionalCompilation import maskInactiveRegions
+
+# One pass over the buffer finds every #define, object-like or function-like, with its
+# backslash continued body: name, parameter list (only if '(' follows the name directly), body
+MACRO_DEFINITION_REGEX = re.compile(
+    r'^[^\S\n]*#[^\S\n]*define[^\S\n]+(\w+)(\(([^)]*)\))?((?:[^\n\\]|\\(?:\r?\n|.))*)', re.MULTILINE)
+# Comments and string literals in a macro body aren't uses of other macros
+MACRO_BODY_NOISE_REGEX = re.compile(r'/\*.*?\*/|//[^\n]*|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.DOTALL)
+IDENTIFIER_REGEX = re.compile(r'\b[A-Za-z_]\w*')
+# Names in a macro body that can never be another macro
+C_KEYWORDS = frozenset(('auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double',
+                        'else', 'enum', 'extern', 'float', 'for', 'goto', 'if', 'inline', 'int', 'long',
+                        'register', 'restrict', 'return', 'short', 'signed', 'sizeof', 'static', 'struct',
+                        'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile', 'while', '_Alignas',
+                        '_Alignof', '_Atomic', '_Bool', '_Complex', '_Generic', '_Imaginary', '_Noreturn',
+                        '_Static_assert', '_Thread_local', 'defined', '__VA_ARGS__', '__VA_OPT__'))
+
+# Each dependency edge keeps a separate weight for every layer
+DEPENDENCY_LAYERS = ('macros', 'functions', 'includes')
+# The layers summed up for each view of the dependencies
+DEPENDENCY_VIEWS = {
+    'all': ('macros', 'functions'),
+    'macros': ('macros',),
+    'functions': ('functions',),
+    'includes': ('includes',)
+}
+
+# Ints per macro in FileNode.macro_info: kind, arity, body start, body end, line
+MACRO_FIELDS = 5
+MACRO_KINDS = ('object', 'function')
+
+def internSymbols(symbols):
+    # Symbols coming back from a worker or the cache are new string objects
+    return {sys.intern(symbol) for symbol in symbols}
+
+def readSourceText(full_path, defines=None):
+    # The buffer the regex pass scanned (masked again if defines are given), files are
+    # read a second time when they're parsed instead of every buffer being held until then
+    # Returns the text and the content hash it was read with
+    source_text, _, content_hash = readSourceFile(full_path)
+    if defines is not None:
+        source_text = maskInactiveRegions(source_text, defines)[0]
+    return source_text, content_hash
+
+def freezeSymbols(symbols):
+    # Sets are only needed while a file's symbols are collected, a sorted
+    # tuple of the interned names takes a fraction of the memory to hold and pickle
+    return tuple(sorted(symbols))
 
 class FileNode():
-    def __init__(self, source_dir, run_dir, file_name, joint_file=0):
+    # Slots instead of a __dict__ per file, a tree can have tens of thousands of them
+    __slots__ = ('name', 'file_id', 'component', 'source_dir', 'content_hash', 'include_paths', 'defines', 'mask_conditionals', 'masked_lines',
+                 'lines_in_file', 'file_dependencies', 'dependency_weights', 'includes',
+                 'unresolved_includes', 'file_dependents', 'macro_candidates', 'macro_dependencies', 'other_dependencies',
+                 'macro_definitions', 'macro_info', 'macro_body_offsets', 'macro_body_names',
+                 'other_definitions', 'symbol_names', 'symbol_edges', 'antlr_errors',
+                 'antlr_ll_fallback', 'budget_fallback', 'antlr_error_rules', 'antlr_error_samples')
+
+    def __init__(self, source_dir, run_dir, file_name, joint_file=0, include_resolver=None,
+                 include_paths=None, defines=None, mask_conditionals=0):
         # File metadata
-        self.name = file_name
-        self.component = run_dir # UCT/UCP/UCS
-        self.source_dir = source_dir
-        self.full_path = source_dir + file_name
-        self.parent_dir = os.path.dirname(self.full_path)
+        self.name = sys.intern(file_name)
+        self.file_id = -1 # Position in the FileIndex
+        self.component = sys.intern(run_dir) # UCT/UCP/UCS
+        self.source_dir = sys.intern(source_dir)
+        self.content_hash = ''
+        # Compile flags from compile_commands.json (None means the default search paths)
+        self.include_paths = include_paths
+        self.defines = defines if defines is not None else {}
+        self.mask_conditionals = mask_conditionals # Set to drop #if branches that can't be compiled with defines
+        self.masked_lines = 0
 
         # File data
         self.lines_in_file = 0
         self.file_dependencies = {} # key = file name, value = # of dependencies
+        self.dependency_weights = {} # key = file name, value = weight for each of DEPENDENCY_LAYERS
+        self.includes = () # Include strings in the order they appear
+        self.unresolved_includes = () # Includes not found in the tree (system headers, missing files)
         self.file_dependents = {}
-        # Things defined outside the file
-        self.macro_dependencies = []
-        self.other_dependencies = []
+        # Things defined outside the file, sorted tuples once the file is extracted
+        self.macro_candidates = () # Every name that could be a macro use (locals and parameters too)
+        self.macro_dependencies = () # The candidates some file defines as a macro, see SymbolIndex
+        self.other_dependencies = ()
         # Things defined within the file
-        self.macro_definitions = []
-        self.other_definitions = []
+        self.macro_definitions = () # Macro names in the order they're first defined
+        self.macro_info = array('i') # MACRO_FIELDS ints per macro of macro_definitions
+        self.macro_body_offsets = array('i', [0]) # Body uses of macro i are macro_body_names[offsets[i]:offsets[i + 1]]
+        self.macro_body_names = ()
+        self.other_definitions = ()
+        # Symbol level uses (only extracted for the symbol graph), see symbolEdges
+        self.symbol_names = () # String table of the file's edges
+        self.symbol_edges = array('i') # Packed edges, EDGE_FIELDS ints each
+        # ANTLR statistics
+        self.antlr_errors = 0 # Number of syntax errors reported
+        self.antlr_ll_fallback = 0 # Set if the SLL parse failed and full LL was needed
+        self.budget_fallback = '' # Set if the parse went over budget and tokens were used instead
+        self.antlr_error_rules = {} # key = grammar rule, value = # of syntax errors in it
+        self.antlr_error_samples = [] # The first few syntax error messages
         
         if not joint_file:
-            self.grepForDependencies()
+            if include_resolver is None:
+                include_resolver = getIncludeResolver(source_dir)
+            self.grepForDependencies(include_resolver)
+
+    def __getstate__(self):
+        # Pickled as a plain tuple in slot order
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __setstate__(self, state):
+        if isinstance(state, dict) or len(state) != len(self.__slots__):
+            raise ValueError("The files data was saved by an older version, run the analysis again without reusing it.")
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    @property
+    def full_path(self):
+        return self.source_dir + self.name
+
+    @property
+    def parent_dir(self):
+        return os.path.dirname(self.full_path)
+
+    @property
+    def macro_index(self):
+        # key = macro name, value = (kind, arity, body span in the buffer, line)
+        info = self.macro_info
+        return {macro: (MACRO_KINDS[info[j]], info[j + 1], (info[j + 2], info[j + 3]), info[j + 4])
+                for macro, j in zip(self.macro_definitions, range(0, len(info), MACRO_FIELDS))}
+
+    @property
+    def macro_body_uses(self):
+        # key = macro name, value = names used in its body
+        offsets = self.macro_body_offsets
+        return {macro: self.macro_body_names[offsets[i]:offsets[i + 1]]
+                for i, macro in enumerate(self.macro_definitions)}
     
     def print(self):
         print(f"Name: {self.name}")
@@ -40,66 +151,98 @@ class FileNode():
         #print(f"Other Calls: {self.other_dependencies}")
         print()
     
-    def grepForDependencies(self):
-        include_regex = re.compile(r'#include\s+["<](.*?)[">]')
-        macro_regex = re.compile(r'#define\s+(\w+)\s*\(')
-
-        # Get the include statements from the file line-by-line
-        lines_count = 0
-        with open(self.full_path, 'r') as f:
-            for line in f:
-                lines_count += 1
-                include_match = include_regex.search(line)
-                macro_match = macro_regex.search(line)
-                if include_match:
-                    include_file = include_match.group(1)
-                    # Check how the path is defined
-                    if os.path.exists(os.path.join(self.source_dir, include_file)):
-                        full_path = os.path.abspath(os.path.join(self.source_dir, include_file))
-                    elif os.path.exists(os.path.join(self.parent_dir, include_file)):
-                        full_path = os.path.join(self.parent_dir, include_file)
-                    else:
-                        continue
-                    # Verify that the resolved path exists
-                    if os.path.isfile(full_path):
-                        relative_path = os.path.realpath(full_path).replace(self.source_dir, "")
-                        self.file_dependencies[relative_path] = 0
-                elif macro_match:
-                    macro = macro_match.group(1)
-                    self.macro_definitions.append(macro)
-        self.lines_in_file = lines_count
-
-    def getAntlrDependencies(self):
-        # ANTLR file stream
-        input_stream = FileStream(self.full_path, encoding='utf-8')
-        # Tokenize the strings and stream the tokens to the parser
-        lexer = CLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = CParser(stream)
-        # Build a tree from the C grammar's "translationUnit" rule
-        tree = parser.translationUnit()
-        # Walk the tree with the listener
-        walker = ParseTreeWalker()
-        result_lists = [self.other_definitions,
-                        self.other_dependencies,
-                        self.macro_dependencies]
-        walker.walk(ModuleExtractionListener(result_lists), tree)
-
-        # Helper function to remove internal dependencies from the lists
-        def remove_list_commonalities(x, y):
-            # Items in x will be removed from y
-            for i in x[:]:
-                if i in y:
-                    y.remove(i)
-        remove_list_commonalities(self.other_definitions, self.other_dependencies)
-        remove_list_commonalities(self.macro_definitions, self.macro_dependencies)
-
-    def shareDependencies(self, run_dirs, files_dict):
-        for dependency in self.file_dependencies.keys():
-            for run_dir in run_dirs:
-                if dependency in files_dict[run_dir].keys():
-                    dependency_obj = files_dict[run_dir][dependency]
-                    dependency_obj.file_dependents[self.name] = self.file_dependencies[dependency]
+    def grepForDependencies(self, include_resolver):
+        include_regex = re.compile(r'#include[^\S\n]+["<](.*?)[">]')
+
+        # Read the file once and scan the whole buffer for the pre-processor statements
+        # The buffer is dropped afterwards, see readSourceText
+        source_text, self.lines_in_file, self.content_hash = readSourceFile(self.full_path)
+        # Inactive #if branches are blanked before anything looks at the buffer
+        if self.mask_conditionals:
+            source_text, self.masked_lines = maskInactiveRegions(source_text, self.defines)
+        self.includes = tuple([sys.intern(include) for include in include_regex.findall(source_text)])
+        self.resolveIncludes(include_resolver)
+        macro_index = {} # key = macro name, value = (kind, arity, body start, body end, line)
+        macro_body_uses = {} # key = macro name, value = names used in its body (a dict keeps their order)
+        line = 1
+        line_start = 0
+        for macro_match in MACRO_DEFINITION_REGEX.finditer(source_text):
+            macro = sys.intern(macro_match.group(1))
+            line += source_text.count('\n', line_start, macro_match.start())
+            line_start = macro_match.start()
+            parameters = []
+            if macro_match.group(2) is None:
+                kind, arity = 0, 0
+            else:
+                parameters = [p.strip() for p in macro_match.group(3).split(',') if p.strip()]
+                kind, arity = 1, len(parameters)
+            macro_index[macro] = (kind, arity) + macro_match.span(4) + (line,)
+            # Other macros expanded in the body
+            body = MACRO_BODY_NOISE_REGEX.sub(' ', macro_match.group(4))
+            body_uses = macro_body_uses.setdefault(macro, {})
+            for name in IDENTIFIER_REGEX.findall(body):
+                if name not in parameters and name != macro and name not in C_KEYWORDS:
+                    body_uses[sys.intern(name)] = None
+        # Packed into flat arrays, one header can define thousands of macros
+        self.macro_definitions = tuple(macro_index)
+        self.macro_info = array('i', [field for fields in macro_index.values() for field in fields])
+        self.macro_body_names = tuple([name for body_uses in macro_body_uses.values() for name in body_uses])
+        self.macro_body_offsets = array('i', [0])
+        for body_uses in macro_body_uses.values():
+            self.macro_body_offsets.append(self.macro_body_offsets[-1] + len(body_uses))
+
+    def resolveIncludes(self, include_resolver):
+        # Resolved from the shared in-memory index, no filesystem probing per include
+        # Run again when files are added to or removed from the tree
+        unresolved_includes = []
+        dependency_weights = {}
+        parent_dir = self.parent_dir
+        for include in self.includes:
+            relative_path = include_resolver.resolve(parent_dir, include, self.include_paths)
+            if relative_path is not None:
+                dependency_weights[relative_path] = self.dependency_weights.get(relative_path, [0, 0, 1])
+            else:
+                unresolved_includes.append(include)
+        self.unresolved_includes = tuple(unresolved_includes)
+        self.dependency_weights = dependency_weights
+        self.file_dependencies = {dependency: self.file_dependencies.get(dependency, 0)
+                                  for dependency in dependency_weights}
+
+    def getAntlrDependencies(self, **antlr_options):
+        # The generated parser is only loaded when a file actually gets parsed
+        from helperFunctions.antlrExtraction import extractAntlrSymbols
+        source_text = readSourceText(self.full_path, self.defines if self.mask_conditionals else None)[0]
+        self.applyAntlrResults(extractAntlrSymbols(source_text, **antlr_options))
+
+    def applyAntlrResults(self, results):
+        other_definitions = internSymbols(results['other_definitions'])
+        macro_dependencies = internSymbols(results['macro_dependencies']).union(self.macro_body_names)
+        # Internal dependencies aren't dependencies on other files
+        self.other_dependencies = freezeSymbols(internSymbols(results['other_dependencies']) - other_definitions)
+        # Only filtered down to real macros once every file's definitions are known
+        self.macro_candidates = freezeSymbols(macro_dependencies.difference(self.macro_definitions))
+        self.macro_dependencies = self.macro_candidates
+        self.other_definitions = freezeSymbols(other_definitions)
+        self.antlr_errors = results['antlr_errors']
+        self.antlr_ll_fallback = results['antlr_ll_fallback']
+        self.budget_fallback = results['budget_fallback']
+        self.antlr_error_rules = results['antlr_error_rules']
+        self.antlr_error_samples = results['antlr_error_samples']
+        if 'symbol_edges' in results:
+            self.symbol_names = tuple([sys.intern(name) for name in results['symbol_names']])
+            self.symbol_edges = results['symbol_edges']
+
+    def shareDependencies(self, file_index):
+        for dependency, weight in self.file_dependencies.items():
+            dependency_obj = file_index.get(dependency)
+            if dependency_obj is not None:
+                dependency_obj.file_dependents[self.name] = weight
+
+    def applyDependencyView(self, view):
+        # Edge weights are a sum over the view's layers, no need to cross-reference again
+        layers = [DEPENDENCY_LAYERS.index(layer) for layer in DEPENDENCY_VIEWS[view]]
+        for dependency, weights in self.dependency_weights.items():
+            self.file_dependencies[dependency] = sum([weights[i] for i in layers])
 
     def resetDependencies(self):
         for key in self.file_dependencies.keys():
@@ -107,7 +250,26 @@ class FileNode():
         for key in self.file_dependents.keys():
             self.file_dependents[key] = 0
 
+class FileIndex():
+    # Flat path -> FileNode index over every run_dir, files also get an integer ID
+    def __init__(self, files_dict):
+        self.files = [] # position = file ID
+        self.paths = {} # key = file name, value = FileNode
+        for sub_dict in files_dict.values():
+            for file in sub_dict.values():
+                self.addFile(file)
+
+    def addFile(self, file):
+        file.file_id = len(self.files)
+        self.files.append(file)
+        self.paths[file.name] = file
+
+    def get(self, file_name):
+        return self.paths.get(file_name)
+
 class ClusterNode():
+    __slots__ = ('name', 'path', 'index', 'source_dir', 'mean_mq', 'files_list')
+
     def __init__(self, source_dir, cluster_path, cluster_index, files_list):
         # File metadata
         self.name = f'{cluster_path}:{cluster_index}'
@@ -0,0 +1,85 @@
+import os
+import hashlib
+import pickle
+
+# Bump this whenever the layout of a cache entry changes
+CACHE_FORMAT_VERSION = 10
+# Files that change what the extraction produces for the same source file
+EXTRACTION_SOURCES = ('antlr_build/C.g4', 'helperFunctions/ModuleExtractionListener.py',
+                      'helperFunctions/antlrExtraction.py', 'helperFunctions/conditionalCompilation.py',
+                      'helperFunctions/tokenExtraction.py', 'helperFunctions/symbolEdges.py')
+
+def getExtractionVersion(antlr_options=None):
+    # Cached data is only valid for the grammar, listener and options that produced it
+    if antlr_options is None:
+        antlr_options = {}
+    version_hash = hashlib.sha1(str(CACHE_FORMAT_VERSION).encode())
+    version_hash.update(repr(sorted(antlr_options.items())).encode())
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for source in EXTRACTION_SOURCES:
+        with open(os.path.join(repo_dir, source), 'rb') as f:
+            version_hash.update(f.read())
+    return version_hash.hexdigest()
+
+class ParseCache():
+    def __init__(self, cache_dir, antlr_options=None):
+        self.cache_dir = cache_dir
+        self.version = getExtractionVersion(antlr_options)
+        self.file_keys = {} # key = file name, value = content hash of the file
+        self.resetCounts()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def resetCounts(self):
+        # Hits and misses of one extraction, watch mode and --git_diff reuse the cache for several
+        self.hits = 0
+        self.misses = 0
+
+    def getKey(self, file):
+        # Content hash taken when the file was read, salted with the extraction version
+        key_hash = hashlib.sha1(file.content_hash.encode())
+        key_hash.update(self.version.encode())
+        # A masked file is parsed differently for every set of defines
+        if file.mask_conditionals:
+            key_hash.update(repr(sorted(file.defines.items())).encode())
+        return key_hash.hexdigest()
+
+    def getEntryPath(self, key):
+        # Fan the entries out over sub-directories to keep directory listings small
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def load(self, file):
+        # Fill in the file's extracted data from the cache, returns None on a miss
+        key = self.getKey(file)
+        self.file_keys[file.name] = key
+        entry_path = self.getEntryPath(key)
+        if not os.path.exists(entry_path):
+            self.misses += 1
+            return None
+        with open(entry_path, 'rb') as f:
+            entry = pickle.load(f)
+        file.lines_in_file = entry['lines_in_file']
+        file.applyAntlrResults(entry)
+        self.hits += 1
+        return entry
+
+    def store(self, file):
+        entry = {
+            'lines_in_file': file.lines_in_file,
+            'other_definitions': file.other_definitions,
+            'other_dependencies': file.other_dependencies,
+            'macro_dependencies': file.macro_candidates,
+            'antlr_errors': file.antlr_errors,
+            'antlr_ll_fallback': file.antlr_ll_fallback,
+            'budget_fallback': file.budget_fallback,
+            'antlr_error_rules': file.antlr_error_rules,
+            'antlr_error_samples': file.antlr_error_samples,
+            'symbol_names': file.symbol_names,
+            'symbol_edges': file.symbol_edges
+        }
+        entry_path = self.getEntryPath(self.file_keys[file.name])
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Write to a temporary file first so an interrupted run can't leave a partial entry
+        temp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(temp_path, entry_path)
@@ -0,0 +1,44 @@
+import os
+import time
+from helperFunctions.handleFileDependencies import getCAndHFilesHelper
+
+class SourceTreeWatcher():
+    # Polls the run directories for added, modified and deleted files
+    # Plain mtime polling, so it works the same on every platform and on network mounts
+    def __init__(self, source_dir, run_dirs):
+        self.source_dir = source_dir
+        self.run_dirs = run_dirs
+        self.file_stats = self.scan() # key = path relative to source_dir, value = (mtime, size)
+
+    def scan(self):
+        file_stats = {}
+        for run_dir in self.run_dirs:
+            for path in getCAndHFilesHelper(self.source_dir + run_dir):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue # Deleted while walking the tree
+                file_stats[os.path.relpath(path, self.source_dir)] = (stat.st_mtime_ns, stat.st_size)
+        return file_stats
+
+    def poll(self, settle_time=0):
+        # Returns the changes since the last poll in the format of getChangedFiles
+        file_stats = self.scan()
+        # Wait for editors and builds to finish writing before reporting the changes
+        while settle_time and file_stats != self.file_stats:
+            time.sleep(settle_time)
+            next_stats = self.scan()
+            if next_stats == file_stats:
+                break
+            file_stats = next_stats
+        changed_files = {}
+        for path, stat in file_stats.items():
+            if path not in self.file_stats:
+                changed_files[path] = 'A'
+            elif stat != self.file_stats[path]:
+                changed_files[path] = 'M'
+        for path in self.file_stats:
+            if path not in file_stats:
+                changed_files[path] = 'D'
+        self.file_stats = file_stats
+        return changed_files
@@ -0,0 +1,111 @@
+import numpy as np
+
+class SparseGraph():
+    # Undirected weighted graph in CSR form with integer node IDs, built from (a, b, weight) edges
+    # Same semantics as a networkx.Graph built from the edges: a repeated pair keeps the last weight
+    # and a self loop is a single neighbor of its node
+    def __init__(self, edges_list=(), nodes=None):
+        self.nodes = list(nodes) if nodes is not None else [] # Node ID -> name, in order of appearance
+        self.node_ids = {node: i for i, node in enumerate(self.nodes)}
+        edge_weights = {} # key = (node ID, node ID), value = weight
+        for a, b, c in edges_list:
+            a_id = self.getNodeId(a)
+            b_id = self.getNodeId(b)
+            edge_weights[(min(a_id, b_id), max(a_id, b_id))] = c
+        self.edge_sources = np.array([a for a, _ in edge_weights], dtype=np.int64)
+        self.edge_targets = np.array([b for _, b in edge_weights], dtype=np.int64)
+        self.edge_weights = np.array(list(edge_weights.values()), dtype=np.float64)
+        self.buildAdjacency()
+
+    def getNodeId(self, node):
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[node] = node_id
+            self.nodes.append(node)
+        return node_id
+
+    def buildAdjacency(self):
+        # Both directions of every edge, self loops only once
+        loops = self.edge_sources == self.edge_targets
+        sources = np.concatenate([self.edge_sources, self.edge_targets[~loops]])
+        targets = np.concatenate([self.edge_targets, self.edge_sources[~loops]])
+        weights = np.concatenate([self.edge_weights, self.edge_weights[~loops]])
+        order = np.lexsort((targets, sources))
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64) # Neighbors of node i are indptr[i]:indptr[i + 1]
+        np.cumsum(np.bincount(sources, minlength=len(self.nodes)), out=self.indptr[1:])
+        self.indices = targets[order] # Neighbor node IDs
+        self.weights = weights[order] # Edge weight of each neighbor
+        self.sources = sources[order] # Node each neighbor entry belongs to
+
+    def getNodeCount(self):
+        return len(self.nodes)
+
+    def getTotalWeight(self):
+        return self.edge_weights.sum()
+
+    def getNeighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def subgraph(self, node_list):
+        # Graph of the edges between the given nodes, they get IDs in the given order
+        node_list = list(node_list)
+        new_ids = np.full(len(self.nodes), -1, dtype=np.int64)
+        new_ids[node_list] = np.arange(len(node_list))
+        kept = (new_ids[self.edge_sources] != -1) & (new_ids[self.edge_targets] != -1)
+        graph = SparseGraph(nodes=[self.nodes[node] for node in node_list])
+        graph.edge_sources = np.minimum(new_ids[self.edge_sources[kept]], new_ids[self.edge_targets[kept]])
+        graph.edge_targets = np.maximum(new_ids[self.edge_sources[kept]], new_ids[self.edge_targets[kept]])
+        graph.edge_weights = self.edge_weights[kept]
+        graph.buildAdjacency()
+        return graph
+
+    def getConnectedComponents(self):
+        # Breadth first search over the CSR arrays, components and their nodes in node ID order
+        component_of = np.full(len(self.nodes), -1, dtype=np.int64)
+        components = []
+        for start in range(len(self.nodes)):
+            if component_of[start] != -1:
+                continue
+            component_of[start] = len(components)
+            frontier = np.array([start])
+            while len(frontier):
+                neighbors = np.unique(np.concatenate([self.getNeighbors(node) for node in frontier]))
+                frontier = neighbors[component_of[neighbors] == -1]
+                component_of[frontier] = len(components)
+            components.append(np.flatnonzero(component_of == len(components)).tolist())
+        return components
+
+    def getLabels(self, partition):
+        # Node ID -> position of its cluster in the partition
+        labels = np.zeros(len(self.nodes), dtype=np.int64)
+        for cluster_id, cluster in enumerate(partition):
+            labels[cluster] = cluster_id
+        return labels
+
+    def getClusterMatrix(self, labels, cluster_count, weighted):
+        # Entry [i, j] counts the neighbor entries (or sums their weights) from cluster i to cluster j
+        # No clusters (heatmaps run with k = -1) means an empty matrix
+        if cluster_count <= 0:
+            return np.zeros((0, 0))
+        keys = labels[self.sources] * cluster_count + labels[self.indices]
+        matrix = np.bincount(keys, weights=self.weights if weighted else None, minlength=cluster_count**2)
+        return matrix.reshape(cluster_count, cluster_count)
+
+    def moveNode(self, matrix, labels, node, from_cluster, to_cluster, weighted):
+        # Cluster matrix after moving one node, only its own neighbor entries change
+        start, end = self.indptr[node], self.indptr[node + 1]
+        neighbors = self.indices[start:end]
+        weights = self.weights[start:end] if weighted else np.ones(end - start)
+        neighbor_labels = labels[neighbors]
+        moved_labels = np.where(neighbors == node, to_cluster, neighbor_labels)
+        cluster_count = len(matrix)
+        delta = np.zeros(cluster_count**2)
+        # Entries from the node
+        np.add.at(delta, from_cluster * cluster_count + neighbor_labels, -weights)
+        np.add.at(delta, to_cluster * cluster_count + moved_labels, weights)
+        # Entries into the node (a self loop was already counted above)
+        others = neighbors != node
+        np.add.at(delta, neighbor_labels[others] * cluster_count + from_cluster, -weights[others])
+        np.add.at(delta, neighbor_labels[others] * cluster_count + to_cluster, weights[others])
+        return matrix + delta.reshape(cluster_count, cluster_count)
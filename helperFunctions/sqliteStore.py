@@ -0,0 +1,118 @@
+import os
+import sqlite3
+from helperFunctions.clusterWorkflow import getLeafFilesHelper
+from helperFunctions.nodesStructs import MACRO_FIELDS, MACRO_KINDS
+
+# Bump this whenever the tables change
+SQLITE_STORE_VERSION = 1
+SQLITE_SCHEMA = '''
+CREATE TABLE files (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, component TEXT,
+                    lines_in_file INTEGER, content_hash TEXT, antlr_errors INTEGER,
+                    antlr_ll_fallback INTEGER, budget_fallback TEXT, masked_lines INTEGER);
+CREATE TABLE symbols (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE definitions (file_id INTEGER NOT NULL REFERENCES files, symbol_id INTEGER NOT NULL REFERENCES symbols,
+                          kind TEXT NOT NULL, macro_kind TEXT, arity INTEGER, line INTEGER);
+CREATE TABLE uses (file_id INTEGER NOT NULL REFERENCES files, symbol_id INTEGER NOT NULL REFERENCES symbols,
+                   kind TEXT NOT NULL);
+CREATE TABLE include_edges (from_file_id INTEGER NOT NULL REFERENCES files, to_file_id INTEGER NOT NULL REFERENCES files,
+                            macros INTEGER, functions INTEGER, includes INTEGER);
+CREATE TABLE cluster_assignments (level TEXT NOT NULL, cluster_id INTEGER NOT NULL,
+                                  file_id INTEGER NOT NULL REFERENCES files, mq_value REAL);
+'''
+# Created after the rows are in, building an index once is cheaper than updating it per row
+SQLITE_INDEXES = '''
+CREATE INDEX definitions_symbol ON definitions (symbol_id, kind);
+CREATE INDEX definitions_file ON definitions (file_id);
+CREATE INDEX uses_symbol ON uses (symbol_id, kind);
+CREATE INDEX uses_file ON uses (file_id);
+CREATE INDEX include_edges_from ON include_edges (from_file_id);
+CREATE INDEX include_edges_to ON include_edges (to_file_id);
+CREATE INDEX cluster_assignments_level ON cluster_assignments (level, cluster_id);
+CREATE INDEX cluster_assignments_file ON cluster_assignments (file_id);
+'''
+
+def writeSqliteStore(files_dict, clusters_dict, db_path):
+    # Write the files data (and the clusters of every directory level if given) to a new database
+    # e.g. the files in uct/ that use a macro:
+    #   SELECT f.name FROM uses u JOIN symbols s ON s.id = u.symbol_id JOIN files f ON f.id = u.file_id
+    #   WHERE s.name = 'UCS_PTR_BYTE_OFFSET' AND f.name LIKE 'uct/%'
+    files_list = [file for sub_dict in files_dict.values() for file in sub_dict.values()]
+    file_ids = {file.name: i for i, file in enumerate(files_list)}
+    symbol_ids = {}
+
+    def getSymbolId(symbol):
+        return symbol_ids.setdefault(symbol, len(symbol_ids))
+
+    def getFileId(file_name):
+        # Included files outside the run directories get a row without data
+        return file_ids.setdefault(file_name, len(file_ids))
+
+    definitions = []
+    uses = []
+    include_edges = []
+    for file_id, file in enumerate(files_list):
+        info = file.macro_info
+        for macro, j in zip(file.macro_definitions, range(0, len(info), MACRO_FIELDS)):
+            definitions.append((file_id, getSymbolId(macro), 'macro', MACRO_KINDS[info[j]], info[j + 1], info[j + 4]))
+        for other in file.other_definitions:
+            definitions.append((file_id, getSymbolId(other), 'other', None, None, None))
+        for macro in file.macro_dependencies:
+            uses.append((file_id, getSymbolId(macro), 'macro'))
+        # A macro is also seen as a plain name by the extractors, it's only stored as a macro use
+        macro_uses = set(file.macro_dependencies)
+        for other in file.other_dependencies:
+            if other in macro_uses:
+                continue
+            uses.append((file_id, getSymbolId(other), 'other'))
+        for dependency, weights in file.dependency_weights.items():
+            include_edges.append((file_id, getFileId(dependency), *weights))
+    cluster_assignments = []
+    for level, level_clusters in (clusters_dict or {}).items():
+        for cluster_node in level_clusters['cluster_nodes'].values():
+            leaf_files = []
+            getLeafFilesHelper(cluster_node, leaf_files)
+            for file in leaf_files:
+                cluster_assignments.append((level, cluster_node.index, getFileId(file.name), level_clusters['mq_value']))
+    file_rows = [(i, file.name, file.component, file.lines_in_file, file.content_hash, file.antlr_errors,
+                  file.antlr_ll_fallback, file.budget_fallback, file.masked_lines)
+                 for i, file in enumerate(files_list)]
+    file_rows += [(i, file_name) + (None,) * 7 for file_name, i in file_ids.items() if i >= len(files_list)]
+
+    # The database is rebuilt from scratch every run, so it's written without a journal
+    # into a temporary file that replaces the old one once it's complete
+    temp_path = f'{db_path}.{os.getpid()}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute(f'PRAGMA user_version = {SQLITE_STORE_VERSION}')
+        with connection:
+            connection.executescript(SQLITE_SCHEMA)
+            connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', file_rows)
+            connection.executemany('INSERT INTO symbols VALUES (?, ?)',
+                                   [(i, symbol) for symbol, i in symbol_ids.items()])
+            connection.executemany('INSERT INTO definitions VALUES (?, ?, ?, ?, ?, ?)', definitions)
+            connection.executemany('INSERT INTO uses VALUES (?, ?, ?)', uses)
+            connection.executemany('INSERT INTO include_edges VALUES (?, ?, ?, ?, ?)', include_edges)
+            connection.executemany('INSERT INTO cluster_assignments VALUES (?, ?, ?, ?)', cluster_assignments)
+            connection.executescript(SQLITE_INDEXES)
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    os.replace(temp_path, db_path)
+    print(f"Wrote {len(file_rows)} files, {len(symbol_ids)} symbols, {len(definitions)} definitions and "
+          f"{len(uses)} uses to {db_path}.")
+
+def querySqliteStore(db_path, query, parameters=()):
+    # Run one read-only query against a store written by writeSqliteStore
+    connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        if connection.execute('PRAGMA user_version').fetchone()[0] != SQLITE_STORE_VERSION:
+            raise ValueError(f"{db_path} is from an unsupported version of the SQLite store, run the analysis again.")
+        cursor = connection.execute(query, parameters)
+        columns = [column[0] for column in cursor.description or ()]
+        return columns, cursor.fetchall()
+    finally:
+        connection.close()
@@ -0,0 +1,32 @@
+from array import array
+
+# What an edge's source and target are
+SYMBOL_KINDS = ('other', 'macro', 'file') # Function/type, macro, uses outside any definition
+OTHER_SYMBOL = 0
+MACRO_SYMBOL = 1
+FILE_SCOPE = 2
+# Ints per packed edge: source, source kind, target, target kind, first line, # of uses
+EDGE_FIELDS = 6
+
+class SymbolEdgeCollector():
+    # Collects the symbol -> symbol uses of one file, each pair is kept once with its first line
+    def __init__(self):
+        self.edges = {} # key = (source, source kind, target, target kind), value = [first line, # of uses]
+
+    def addEdge(self, source, source_kind, target, target_kind, line):
+        key = (source, source_kind, target, target_kind)
+        edge = self.edges.get(key)
+        if edge is None:
+            self.edges[key] = [line, 1]
+        else:
+            edge[1] += 1
+
+    def pack(self):
+        # Names go in a per-file string table, the edges in one flat int array
+        names = {}
+        edges = array('i')
+        for (source, source_kind, target, target_kind), (line, count) in self.edges.items():
+            source_id = names.setdefault(source, len(names))
+            target_id = names.setdefault(target, len(names))
+            edges.extend((source_id, source_kind, target_id, target_kind, line, count))
+        return list(names), edges
@@ -0,0 +1,213 @@
+import os
+from array import array
+import numpy as np
+from helperFunctions.symbolIndex import SymbolIndex
+from helperFunctions.nodesStructs import MACRO_FIELDS
+from helperFunctions.symbolEdges import SYMBOL_KINDS, OTHER_SYMBOL, MACRO_SYMBOL, EDGE_FIELDS
+from contextlib import redirect_stdout
+
+# Bump this whenever the layout of the saved arrays changes
+SYMBOL_GRAPH_VERSION = 1
+
+class StringTable():
+    # Every name is stored once, everything else refers to it by its position
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.ids = {string: i for i, string in enumerate(self.strings)}
+
+    def getId(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+        return string_id
+
+    def pack(self):
+        # One utf-8 buffer plus offsets instead of an array of Python strings
+        encoded = [string.encode() for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.array([len(string) for string in encoded], dtype=np.int64))
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    @staticmethod
+    def unpack(buffer, offsets):
+        data = buffer.tobytes()
+        return StringTable([data[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)])
+
+def mergeEdgesHelper(sources, targets, lines, counts, node_count):
+    # Sums duplicate (source, target) pairs, the result is sorted by source then target
+    keys = sources.astype(np.int64) * node_count + targets
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int32)
+    merged_lines = np.full(len(unique_keys), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(merged_lines, inverse, lines)
+    return (unique_keys // node_count).astype(np.int32), (unique_keys % node_count).astype(np.int32), \
+        merged_lines, merged_counts
+
+class SymbolGraph():
+    # Symbol -> symbol uses in CSR form, nodes are the definitions of each file
+    # (plus one node per file for uses outside any definition)
+    def __init__(self, strings, file_names, node_file, node_name, node_kind, indptr, indices, edge_line, edge_count):
+        self.strings = strings # StringTable of symbol and file names
+        self.file_names = file_names # File ID -> name ID
+        self.node_file = node_file # Node ID -> file ID
+        self.node_name = node_name # Node ID -> name ID
+        self.node_kind = node_kind # Node ID -> position in SYMBOL_KINDS
+        self.indptr = indptr # Edges of node i are indptr[i]:indptr[i + 1]
+        self.indices = indices # Edge -> target node ID
+        self.edge_line = edge_line # Edge -> line of the first use
+        self.edge_count = edge_count # Edge -> # of uses
+
+    def getNodeCount(self):
+        return len(self.node_file)
+
+    def getEdgeCount(self):
+        return len(self.indices)
+
+    def getNodeName(self, node):
+        file_name = self.strings.strings[self.file_names[self.node_file[node]]]
+        return f'{file_name}:{self.strings.strings[self.node_name[node]]}'
+
+    def getEdgeSources(self):
+        return np.repeat(np.arange(self.getNodeCount(), dtype=np.int32), np.diff(self.indptr))
+
+    def aggregate(self, node_groups, group_count):
+        # Collapse the nodes into groups (files, directories), edges inside a group are dropped
+        # Returns source group, target group, # of symbol edges and # of uses for every group edge
+        source_groups = node_groups[self.getEdgeSources()]
+        target_groups = node_groups[self.indices]
+        between_groups = source_groups != target_groups
+        keys = source_groups[between_groups].astype(np.int64) * group_count + target_groups[between_groups]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        edge_counts = np.bincount(inverse, minlength=len(unique_keys))
+        uses = np.bincount(inverse, weights=self.edge_count[between_groups], minlength=len(unique_keys))
+        return (unique_keys // group_count).astype(np.int32), (unique_keys % group_count).astype(np.int32), \
+            edge_counts, uses.astype(np.int64)
+
+    def getFileGraph(self):
+        return self.aggregate(self.node_file, len(self.file_names))
+
+    def getDirectoryGraph(self, depth=None):
+        # Files are grouped by their directory, cut to the first depth parts of the path
+        directories = StringTable()
+        file_directories = []
+        for name_id in self.file_names:
+            parts = os.path.dirname(self.strings.strings[name_id]).strip('/').split('/')
+            file_directories.append(directories.getId('/'.join(parts[:depth])))
+        file_directories = np.array(file_directories, dtype=np.int32)
+        return directories.strings, self.aggregate(file_directories[self.node_file], len(directories.strings))
+
+    def save(self, graph_path):
+        string_buffer, string_offsets = self.strings.pack()
+        np.savez_compressed(graph_path, version=np.array([SYMBOL_GRAPH_VERSION]),
+                            string_buffer=string_buffer, string_offsets=string_offsets,
+                            file_names=self.file_names, node_file=self.node_file, node_name=self.node_name,
+                            node_kind=self.node_kind, indptr=self.indptr, indices=self.indices,
+                            edge_line=self.edge_line, edge_count=self.edge_count)
+
+    @staticmethod
+    def load(graph_path):
+        with np.load(graph_path) as data:
+            if data['version'][0] != SYMBOL_GRAPH_VERSION:
+                raise ValueError(f"{graph_path} is from an unsupported version of the symbol graph")
+            return SymbolGraph(StringTable.unpack(data['string_buffer'], data['string_offsets']),
+                               data['file_names'], data['node_file'], data['node_name'], data['node_kind'],
+                               data['indptr'], data['indices'], data['edge_line'], data['edge_count'])
+
+def buildSymbolGraph(files_list):
+    # Resolve every symbol use the same way as the file edges: a definition in the
+    # using file wins, otherwise every included file that defines the symbol
+    strings = StringTable()
+    symbol_index = SymbolIndex(files_list)
+    definers = {OTHER_SYMBOL: symbol_index.other_definers, MACRO_SYMBOL: symbol_index.macro_definers}
+    file_ids = {file.name: i for i, file in enumerate(files_list)}
+    node_ids = {} # key = (file ID, name ID, kind), value = node ID
+    node_file, node_name, node_kind = array('i'), array('i'), array('i')
+
+    def getNode(file_id, name, kind):
+        key = (file_id, strings.getId(name), kind)
+        node = node_ids.get(key)
+        if node is None:
+            node = len(node_file)
+            node_ids[key] = node
+            node_file.append(file_id)
+            node_name.append(key[1])
+            node_kind.append(kind)
+        return node
+
+    file_names = np.array([strings.getId(file.name) for file in files_list], dtype=np.int32)
+    for file_id, file in enumerate(files_list):
+        for name in file.other_definitions:
+            getNode(file_id, name, OTHER_SYMBOL)
+        for name in file.macro_definitions:
+            getNode(file_id, name, MACRO_SYMBOL)
+
+    sources, targets, lines, counts = array('i'), array('i'), array('i'), array('i')
+    for file_id, file in enumerate(files_list):
+        resolved = {} # key = (name, kind), value = target node IDs
+
+        def resolveHelper(name, kind):
+            key = (name, kind)
+            if key not in resolved:
+                defining_files = definers[kind].get(name, ())
+                if file.name in defining_files:
+                    target_files = [file_id]
+                else:
+                    target_files = [file_ids[f] for f in defining_files if f in file.dependency_weights]
+                resolved[key] = [getNode(target_file, name, kind) for target_file in target_files]
+            return resolved[key]
+
+        def addEdgesHelper(source, name, kind, line, count):
+            # Names nothing in the tree defines (locals, libc) aren't in the graph
+            for target in resolveHelper(name, kind):
+                if target != source:
+                    sources.append(source)
+                    targets.append(target)
+                    lines.append(line)
+                    counts.append(count)
+
+        names = file.symbol_names
+        edges = file.symbol_edges
+        for source_id, source_kind, target_id, target_kind, line, count in zip(
+                *[edges[i::EDGE_FIELDS] for i in range(EDGE_FIELDS)]):
+            source = getNode(file_id, names[source_id], source_kind)
+            addEdgesHelper(source, names[target_id], target_kind, line, count)
+        # Macro bodies can expand to other macros and call functions
+        macro_lines = file.macro_info[MACRO_FIELDS - 1::MACRO_FIELDS]
+        for (macro, body_uses), line in zip(file.macro_body_uses.items(), macro_lines):
+            source = getNode(file_id, macro, MACRO_SYMBOL)
+            for name in body_uses:
+                addEdgesHelper(source, name, MACRO_SYMBOL, line, 1)
+                addEdgesHelper(source, name, OTHER_SYMBOL, line, 1)
+
+    node_count = max(len(node_file), 1)
+    sources, targets, lines, counts = mergeEdgesHelper(
+        np.asarray(sources, dtype=np.int32), np.asarray(targets, dtype=np.int32),
+        np.asarray(lines, dtype=np.int32), np.asarray(counts, dtype=np.int32), node_count)
+    indptr = np.zeros(len(node_file) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(node_file)), out=indptr[1:])
+    graph = SymbolGraph(strings, file_names, np.asarray(node_file, dtype=np.int32),
+                        np.asarray(node_name, dtype=np.int32),
+                        np.asarray(node_kind, dtype=np.int32).astype(np.int8),
+                        indptr, targets, lines, counts)
+    return graph
+
+def writeSymbolGraph(files_dict, graph_path, directory_outputs):
+    # Build the symbol graph of the files data, save it and write its directory level edges
+    files_list = [file for sub_dict in files_dict.values() for file in sub_dict.values()]
+    if not any([len(file.symbol_edges) for file in files_list]):
+        print("WARNING: no symbol uses were extracted, only macro bodies are in the symbol graph "
+              "(a snapshot or parse cache from a run without --symbol_graph was used).")
+    graph = buildSymbolGraph(files_list)
+    graph.save(graph_path)
+    directories, (sources, targets, edge_counts, uses) = graph.getDirectoryGraph()
+    with open(directory_outputs, 'w') as f:
+        with redirect_stdout(f):
+            print("from_dir,to_dir,symbol_edges,uses")
+            for source, target, edge_count, use_count in zip(sources, targets, edge_counts, uses):
+                print(f"{directories[source]},{directories[target]},{edge_count},{use_count}")
+    kind_counts = np.bincount(graph.node_kind, minlength=len(SYMBOL_KINDS))
+    print(f"Symbol graph: {graph.getNodeCount()} symbols ({', '.join([f'{count} {kind}' for kind, count in zip(SYMBOL_KINDS, kind_counts)])}), "
+          f"{graph.getEdgeCount()} edges.")
+    return graph
@@ -0,0 +1,64 @@
+class SymbolIndex():
+    # Inverted index from each defined symbol to the files that define it
+    def __init__(self, files_list=None, link_resolution=0):
+        self.macro_definers = {} # key = macro name, value = list of defining file names
+        self.other_definers = {} # key = function/type name, value = list of defining file names
+        # Set to link uses no included file defines to the only file in the tree that does,
+        # like the linker would (e.g. a call through a header prototype to its .c file)
+        self.link_resolution = link_resolution
+        for file in files_list or ():
+            self.addFile(file)
+
+    def addFile(self, file):
+        for macro in file.macro_definitions:
+            self.macro_definers.setdefault(macro, []).append(file.name)
+        for other in file.other_definitions:
+            self.other_definers.setdefault(other, []).append(file.name)
+
+    def removeFile(self, file):
+        def removeHelper(definers, symbols):
+            for symbol in symbols:
+                files = definers.get(symbol)
+                if files is None or file.name not in files:
+                    continue
+                files.remove(file.name)
+                if not files:
+                    del definers[symbol]
+        removeHelper(self.macro_definers, file.macro_definitions)
+        removeHelper(self.other_definers, file.other_definitions)
+
+    def filterMacroUses(self, file):
+        # The extractors can't tell a macro from a local or a parameter by name,
+        # only the candidates some file defines as a macro are kept as uses
+        macro_definers = self.macro_definers
+        file.macro_dependencies = tuple([macro for macro in file.macro_candidates if macro in macro_definers])
+
+    def countLayeredUses(self, file):
+        # Weight each included file by the number of this file's uses it defines,
+        # macros and functions/types are counted in separate layers of the edge
+        # Linear in the number of uses, no matter how many files are included
+        self.filterMacroUses(file)
+        dependency_weights = file.dependency_weights
+        # Linked edges have no include layer, they're found again from scratch
+        if self.link_resolution:
+            for file_j_key in [key for key, weights in dependency_weights.items() if not weights[2]]:
+                del dependency_weights[file_j_key]
+                file.file_dependencies.pop(file_j_key, None)
+        for weights in dependency_weights.values():
+            weights[0] = 0
+            weights[1] = 0
+        for macro in file.macro_dependencies:
+            for file_j_key in self.macro_definers.get(macro, ()):
+                if file_j_key in dependency_weights:
+                    dependency_weights[file_j_key][0] += 1
+        for other in file.other_dependencies:
+            definers = self.other_definers.get(other, ())
+            included = 0
+            for file_j_key in definers:
+                weights = dependency_weights.get(file_j_key)
+                if weights is not None and weights[2]:
+                    weights[1] += 1
+                    included = 1
+            # Names defined in several files (static functions) can't be linked to one of them
+            if self.link_resolution and not included and len(definers) == 1:
+                dependency_weights.setdefault(definers[0], [0, 0, 0])[1] += 1
@@ -0,0 +1,139 @@
+from antlr4 import Token
+from antlr_build.CLexer import CLexer
+from helperFunctions.symbolEdges import OTHER_SYMBOL, MACRO_SYMBOL, FILE_SCOPE
+
+# Tokens that end a declaration or statement at the top level of a file
+BOUNDARY_TOKENS = (CLexer.Semi, CLexer.LeftBrace, CLexer.RightBrace)
+
+def findClosingParen(tokens, i):
+    # Returns the index of the ')' matching the '(' at index i
+    # Stops early on unbalanced parens so a syntax error can't swallow the rest of the file
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j].type in (CLexer.LeftBrace, CLexer.Semi):
+            return j - 1
+        if tokens[j].type == CLexer.LeftParen:
+            depth += 1
+        elif tokens[j].type == CLexer.RightParen:
+            depth -= 1
+            if depth == 0:
+                return j
+    return len(tokens) - 1
+
+def getDeclarationTypes(tokens):
+    # Approximates the declaration specifiers of a return type or a single parameter
+    # The last identifier is the declared name, everything else but pointers is the type
+    type_tokens = [t for t in tokens if t.type not in (CLexer.Star, CLexer.Comma)]
+    if len(type_tokens) > 1 and type_tokens[-1].type == CLexer.Identifier:
+        type_tokens = type_tokens[:-1]
+    return [t.text for t in type_tokens]
+
+def getParameterTypes(tokens):
+    # Split a parameter list (without its parens) on the top level commas
+    parameter_types = []
+    parameter = []
+    depth = 0
+    for t in tokens:
+        if t.type == CLexer.LeftParen:
+            depth += 1
+        elif t.type == CLexer.RightParen:
+            depth -= 1
+        if t.type == CLexer.Comma and depth == 0:
+            parameter_types.extend(getDeclarationTypes(parameter))
+            parameter = []
+        else:
+            parameter.append(t)
+    if parameter and not (len(parameter) == 1 and parameter[0].type == CLexer.Void):
+        parameter_types.extend(getDeclarationTypes(parameter))
+    return parameter_types
+
+def extractTokenSymbols(tokens, edge_collector=None):
+    # Approximates what ModuleExtractionListener finds using only token patterns:
+    #   Identifier '(' ... ')' '{' at brace depth 0 is a definition
+    #   Identifier '(' at statement start on the top level is a macro invocation
+    #   Identifier '(' anywhere else is a call
+    #   Any other Identifier in a body is a possible object-like macro use
+    # Uses inside a definition's braces are attributed to it for edge_collector
+    tokens = [t for t in tokens if t.channel == Token.DEFAULT_CHANNEL and t.type != Token.EOF]
+    other_definitions = set()
+    other_dependencies = set()
+    macro_dependencies = set()
+    current_function = ''
+
+    def addUse(uses, kind, name, line):
+        uses.add(name)
+        if edge_collector is not None:
+            source_kind = OTHER_SYMBOL if current_function else FILE_SCOPE
+            edge_collector.addEdge(current_function, source_kind, name, kind, line)
+
+    brace_depth = 0
+    statement_start = 0 # Index of the first token of the current top level declaration
+    typedef_name = None
+    in_typedef = 0
+    typedef_locked = 0
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        next_type = tokens[i + 1].type if i + 1 < len(tokens) else None
+        prev_type = tokens[i - 1].type if i > 0 else None
+
+        if t.type == CLexer.LeftBrace:
+            brace_depth += 1
+        elif t.type == CLexer.RightBrace:
+            brace_depth = max(brace_depth - 1, 0)
+            if brace_depth == 0:
+                current_function = ''
+                if not in_typedef:
+                    statement_start = i + 1
+        elif t.type == CLexer.Semi and brace_depth == 0:
+            if in_typedef and typedef_name is not None:
+                other_definitions.add(typedef_name)
+            in_typedef = 0
+            typedef_locked = 0
+            typedef_name = None
+            statement_start = i + 1
+        elif t.type == CLexer.Typedef and brace_depth == 0:
+            in_typedef = 1
+        elif t.type in (CLexer.Struct, CLexer.Union):
+            # struct name { ... } defines the struct
+            if next_type == CLexer.Identifier and i + 2 < len(tokens) and tokens[i + 2].type == CLexer.LeftBrace:
+                other_definitions.add(tokens[i + 1].text)
+                i += 1
+        elif t.type == CLexer.Identifier:
+            if in_typedef and brace_depth == 0 and not typedef_locked:
+                typedef_name = t.text
+                # typedef ret (*name)(args) names the function pointer type
+                if prev_type == CLexer.Star and i > 1 and tokens[i - 2].type == CLexer.LeftParen:
+                    typedef_locked = 1
+            if next_type == CLexer.LeftParen:
+                close_index = findClosingParen(tokens, i + 1)
+                after_type = tokens[close_index + 1].type if close_index + 1 < len(tokens) else None
+                at_statement_start = i == statement_start
+                if brace_depth == 0 and not in_typedef:
+                    if at_statement_start:
+                        # Nothing in front of the name, has to be a macro
+                        addUse(macro_dependencies, MACRO_SYMBOL, t.text, t.line)
+                    elif after_type == CLexer.LeftBrace:
+                        other_definitions.add(t.text)
+                        current_function = t.text
+                        for type_name in getDeclarationTypes(tokens[statement_start:i]) + \
+                                getParameterTypes(tokens[i + 2:close_index]):
+                            addUse(other_dependencies, OTHER_SYMBOL, type_name, t.line)
+                    i = close_index
+                elif brace_depth > 0:
+                    addUse(other_dependencies, OTHER_SYMBOL, t.text, t.line)
+                    addUse(macro_dependencies, MACRO_SYMBOL, t.text, t.line)
+            elif next_type == CLexer.Identifier or (next_type == CLexer.Star and
+                    prev_type in (None, CLexer.LeftParen, CLexer.Comma) + BOUNDARY_TOKENS):
+                # A name followed by another name or a pointer declaration is a type
+                addUse(other_dependencies, OTHER_SYMBOL, t.text, t.line)
+            elif brace_depth > 0:
+                # Any other name in a body could be an object-like macro
+                addUse(macro_dependencies, MACRO_SYMBOL, t.text, t.line)
+        i += 1
+
+    return {
+        'other_definitions': other_definitions,
+        'other_dependencies': other_dependencies,
+        'macro_dependencies': macro_dependencies
+    }
@@ -1,9 +1,26 @@
 import os
-import pickle
+import time
 from helperFunctions.handleFileDependencies import getFileDependencies
 from helperFunctions.handleFileDependencies import reconstrainFileReferences
+from helperFunctions.handleFileDependencies import compareExtractors
+from helperFunctions.handleFileDependencies import writeErrorReports
+from helperFunctions.incrementalAnalysis import getChangedFiles
+from helperFunctions.incrementalAnalysis import getRevision
+from helperFunctions.incrementalAnalysis import getTreeRevision
+from helperFunctions.incrementalAnalysis import updateFileDependencies
+from helperFunctions.sourceWatcher import SourceTreeWatcher
+from helperFunctions.includeResolver import getIncludeResolver
+from helperFunctions.symbolIndex import SymbolIndex
+from helperFunctions.filesDataStore import saveFilesData
+from helperFunctions.filesDataStore import loadFilesData
+from helperFunctions.filesDataStore import loadFilesMeta
+from helperFunctions.sqliteStore import writeSqliteStore
+from helperFunctions.sqliteStore import querySqliteStore
 from helperFunctions.clusterWorkflow import executeClusterWorkflow
 from helperFunctions.joinCAndHFiles import joinCAndHFiles
+from helperFunctions.parseCache import ParseCache
+from helperFunctions.compileCommands import readCompileCommands
+from helperFunctions.compileCommands import getDefineFlags
 import argparse
 from contextlib import redirect_stdout
 
@@ -14,76 +31,8 @@ from contextlib import redirect_stdout
 #       Isolate for macro/function dependencies and see how they are different
 #       Analyse which unweighted clustering algorithm leads to better MQ values
 
-############### INPUT VARIABLES ###############
-parser = argparse.ArgumentParser()
-parser.add_argument("-s", "--source_dir", help = "Path to the source code directory.", required=True)
-parser.add_argument("-o", "--outputs_dir", help = "Path to the directory to use for output files.", required=True)
-parser.add_argument("-p", "--project", help = "The name of the project being analysed.", required=True)
-parser.add_argument("-d", "--directories", help = "The list of sub-directories to observe in SOURCE_DIR.", nargs='+', required=True)
-parser.add_argument("-a", "--algorithm", help = "The algorithm to use: 0 - Suboptimal, 1 - Genetic, 2 - Suboptimal (Weighted), 3 - Genetic (Weighted)", required=True, type=int)
-parser.add_argument("--random_samples", help = "The number of random start points to cycle through for the algorithm.", default=1, type=int)
-parser.add_argument("--heatmap", help = "Flag to print heatmaps instead of clusters.", default=0, type=int)
-parser.add_argument("--macros_only", help = "Flag to only consider macro dependencies, not functions.", default=0, type=int)
-parser.add_argument("--functions_only", help = "Flag to only consider function dependencies, not macros.", default=0, type=int)
-parser.add_argument("--joint_files", help = "Flag to join files of the same name (.c, .h, and .c4).", default=1, type=int)
-parser.add_argument("--max_plot_depth", help = "The number of directories to plot recursively (top level is 0).", default=3, type=int)
-args = parser.parse_args()
-
-if args.macros_only and args.functions_only:
-    print("ERROR: only one flag out of macros_only and functions_only can be set at once!")
-    exit(1)
-
-if __name__ == "__main__":
-    ############### INITIALIZATION ###############
-    # File path info
-    output_dir = f'{args.outputs_dir}/{args.project}_outputs'
-    pickle_name = f'{args.project}_files_data.pkl'
-    antlr_err_name = f'{args.project}_antlr_error_outputs.txt'
-    pickle_path = f'{output_dir}/{pickle_name}'
-    antlr_err_outputs = f'{output_dir}/antlr_error_outputs.txt'
-    os.makedirs(output_dir, exist_ok=True)
-    # Handle file extensions for different dependency considerations
-    if args.macros_only:
-        output_dir += "/macros_only"
-        os.makedirs(output_dir, exist_ok=True)
-    elif args.functions_only:
-        output_dir += "/functions_only"
-        os.makedirs(output_dir, exist_ok=True)
-    else:
-        output_dir += "/all_dependencies"
-        os.makedirs(output_dir, exist_ok=True)
-    # Other runtime variables
-    generate_files = 0
-    if not os.path.exists(pickle_path):
-        generate_files = 1
-    algorithm = ("suboptimal", "genetic", "suboptimal_weighted", "genetic_weighted")[args.algorithm]
-    # -1 is heatmap, 0 is dynamic, other is the specific # of clusters
-    if args.heatmap:
-        k_values = (-1,-1,-1)
-    else:
-        k_values = (0, 0, 0)
-
-    ############### DATA COLLECTION ###############
-    # Get the dependancy data for all the files in the project
-    if generate_files:
-        files_dict = getFileDependencies(args.source_dir, args.directories, antlr_err_outputs)
-        # Save files_dict to a file
-        with open(pickle_path, "wb") as f:
-            pickle.dump(files_dict, f)
-    else:
-        with open(pickle_path, "rb") as f:
-            files_dict = pickle.load(f)
-    
-    # Combine the .c and .h files for better utility
-    if args.macros_only:
-        reconstrainFileReferences(args.directories, files_dict, 'macros')
-    elif args.functions_only:
-        reconstrainFileReferences(args.directories, files_dict, 'functions')
-    elif 1: #args.joint_files:
-        files_dict = joinCAndHFiles(files_dict, args.source_dir)
-    
+def writeMetadata(files_dict, csv_file):
     # Get metadata for the whole codebase
-    csv_file = f'{output_dir}/test_file_full.csv'
     files_list = [file for run_dir in files_dict.keys() for file in files_dict[run_dir].values()]
     with open(csv_file, 'w') as f:
         with redirect_stdout(f):
@@ -115,7 +64,270 @@ if __name__ == "__main__":
                 print(f"{dir} h_only,{h_files},{h_loc}")
                 print(f"{dir} inl_only,{inl_files},{inl_loc}")
 
-    ############### MAIN WORKFLOW ###############
-    executeClusterWorkflow(files_dict, algorithm, args.source_dir, output_dir, k_values,
-                args.random_samples, tuple(args.directories), args.project, args.max_plot_depth)
-    
+def analyze(source_dir, outputs_dir, project, directories, algorithm=0, random_samples=1, heatmap=0,
+            macros_only=0, functions_only=0, joint_files=1, max_plot_depth=3, parse_cache=1,
+            two_stage_parse=0, time_budget=0, token_budget=0, max_syntax_errors=0, extractor='antlr',
+            extractor_sample=0, include_paths=(), compile_commands=None, reuse_snapshot=0, dfa_cache=None,
+            dfa_warmup=0, mask_conditionals=0, defines=(), undefines=(), metadata_only=0, git_diff=None, watch=0,
+            watch_interval=1, watch_persist_delay=30, symbol_graph=0, link_resolution=0, sqlite=0, sql_query=None, jobs=1):
+    # Runs the whole analysis and returns the files data, the arguments match the command line flags
+    if macros_only and functions_only:
+        raise ValueError("only one flag out of macros_only and functions_only can be set at once")
+    if git_diff and len(git_diff) > 2:
+        raise ValueError("git_diff takes one or two revisions")
+    # The query runs against the database this run writes, never a stale one from an earlier run
+    if sql_query and not sqlite:
+        raise ValueError("sql_query needs sqlite to be set")
+
+    ############### INITIALIZATION ###############
+    # File path info
+    output_dir = f'{outputs_dir}/{project}_outputs'
+    files_data_name = f'{project}_files_data'
+    files_data_path = f'{output_dir}/{files_data_name}'
+    parse_cache_dir = f'{output_dir}/{project}_parse_cache'
+    antlr_err_outputs = f'{output_dir}/antlr_error_outputs.txt'
+    antlr_stats_outputs = f'{output_dir}/antlr_file_stats.csv'
+    comparison_outputs = f'{output_dir}/extractor_comparison.csv'
+    rule_error_outputs = f'{output_dir}/antlr_rule_errors.csv'
+    library_error_outputs = f'{output_dir}/antlr_library_errors.csv'
+    symbol_graph_path = f'{output_dir}/{project}_symbol_graph.npz'
+    symbol_graph_outputs = f'{output_dir}/symbol_graph_directories.csv'
+    os.makedirs(output_dir, exist_ok=True)
+    # Handle file extensions for different dependency considerations
+    if macros_only:
+        output_dir += "/macros_only"
+        os.makedirs(output_dir, exist_ok=True)
+    elif functions_only:
+        output_dir += "/functions_only"
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        output_dir += "/all_dependencies"
+        os.makedirs(output_dir, exist_ok=True)
+    sqlite_path = f'{output_dir}/{project}_files_data.sqlite'
+    # Other runtime variables
+    algorithm = ("suboptimal", "genetic", "suboptimal_weighted", "genetic_weighted")[algorithm]
+    # -1 is heatmap, 0 is dynamic, other is the specific # of clusters
+    if heatmap:
+        k_values = (-1,-1,-1)
+    else:
+        k_values = (0, 0, 0)
+
+    ############### DATA COLLECTION ###############
+    # Get the dependancy data for all the files in the project
+    # Unchanged files are served from the parse cache, so only edited files get re-parsed
+    antlr_options = {'two_stage_parse': two_stage_parse,
+                     'time_budget': time_budget,
+                     'token_budget': token_budget,
+                     'max_errors': max_syntax_errors,
+                     'extractor': extractor,
+                     'symbol_edges': symbol_graph}
+    file_parse_cache = None
+    if parse_cache:
+        file_parse_cache = ParseCache(parse_cache_dir, antlr_options)
+    translation_units = None
+    if compile_commands:
+        translation_units = readCompileCommands(compile_commands)
+    # Start the parser from the DFA built up by earlier runs instead of from scratch
+    parser_dfa_cache = None
+    if dfa_cache:
+        from helperFunctions.dfaCache import DFACache
+        parser_dfa_cache = DFACache(dfa_cache)
+        print(f"Loaded {parser_dfa_cache.load()} parser DFA states from {dfa_cache}.")
+    # Mask out the #if branches that aren't compiled for one build configuration
+    build_defines = None
+    if mask_conditionals:
+        build_defines = getDefineFlags(defines, undefines)
+    # The snapshot holds every weight layer, so the dependency views don't need a new extraction
+    changed_files = None
+    # One index of the tree for this run, the incremental updates keep it in sync with the edits
+    include_resolver = None
+    if reuse_snapshot and os.path.exists(files_data_path):
+        # Only the files of the directories asked for are read from the store
+        files_dict = loadFilesData(files_data_path, [directory.rstrip('/') + '/' for directory in directories])
+        # Linked edges are part of the snapshot, later updates (watch mode) keep its mode
+        snapshot_link_resolution = loadFilesMeta(files_data_path).get('link_resolution', link_resolution)
+        if snapshot_link_resolution != link_resolution:
+            print(f"WARNING: the saved snapshot was extracted with link_resolution {snapshot_link_resolution}, it's kept.")
+            link_resolution = snapshot_link_resolution
+    else:
+        # The diff only patches the snapshot correctly if the snapshot was taken at REV_A
+        # with the same link resolution mode
+        use_git_diff = git_diff and os.path.exists(files_data_path)
+        if use_git_diff:
+            snapshot_meta = loadFilesMeta(files_data_path)
+            if snapshot_meta.get('revision') != getRevision(source_dir, git_diff[0]):
+                print(f"WARNING: the saved snapshot wasn't extracted from {git_diff[0]}, every file is extracted again.")
+                use_git_diff = False
+            elif snapshot_meta.get('link_resolution') != link_resolution:
+                print(f"WARNING: the saved snapshot wasn't extracted with link_resolution {link_resolution}, every file is extracted again.")
+                use_git_diff = False
+        include_resolver = getIncludeResolver(source_dir, include_paths)
+        if use_git_diff:
+            # Only the files git reports as changed since the snapshot are extracted again
+            files_dict = loadFilesData(files_data_path)
+            changed_paths = getChangedFiles(source_dir, *git_diff)
+            print(f"git reports {len(changed_paths)} changed files since {git_diff[0]}.")
+            changed_files = updateFileDependencies(files_dict, changed_paths, source_dir, directories,
+                                                   antlr_err_outputs, jobs, file_parse_cache, antlr_options,
+                                                   include_paths, translation_units, parser_dfa_cache,
+                                                   dfa_warmup, build_defines, link_resolution=link_resolution,
+                                                   include_resolver=include_resolver)
+        else:
+            files_dict = getFileDependencies(source_dir, directories, antlr_err_outputs,
+                                             jobs, file_parse_cache, antlr_options, include_paths,
+                                             translation_units, parser_dfa_cache, dfa_warmup, build_defines,
+                                             link_resolution, include_resolver)
+        # Save files_dict to a file, along with the commit it matches for a later --git_diff
+        saveFilesData(files_dict, files_data_path, getTreeRevision(source_dir), link_resolution)
+        # Check the fast extractor against the full parse
+        if extractor_sample:
+            files_list = [file for run_dir in files_dict.keys() for file in files_dict[run_dir].values()]
+            compareExtractors(files_list, extractor_sample, comparison_outputs, antlr_options)
+        # Per-file parser statistics
+        with open(antlr_stats_outputs, 'w') as f:
+            with redirect_stdout(f):
+                print("file_path,lines_of_code,syntax_errors,ll_fallback,budget_fallback,masked_lines")
+                for run_dir in files_dict.keys():
+                    for file in files_dict[run_dir].values():
+                        print(f"{file.name},{file.lines_in_file},{file.antlr_errors},{file.antlr_ll_fallback},{file.budget_fallback},{file.masked_lines}")
+        # Syntax errors per grammar rule and per library
+        writeErrorReports(files_dict, rule_error_outputs, library_error_outputs)
+    # Function/macro level graph in integer arrays, the file and directory graphs are aggregated from it
+    if symbol_graph:
+        from helperFunctions.symbolGraph import writeSymbolGraph
+        writeSymbolGraph(files_dict, symbol_graph_path, symbol_graph_outputs)
+
+    def runWorkflow(files_dict, changed_files):
+        # Combine the .c and .h files for better utility
+        joint_files_dict = files_dict
+        if macros_only:
+            reconstrainFileReferences(files_dict, 'macros')
+        elif functions_only:
+            reconstrainFileReferences(files_dict, 'functions')
+        elif 1: #joint_files:
+            joint_files_dict = joinCAndHFiles(files_dict, source_dir)
+
+        # Get metadata for the whole codebase
+        writeMetadata(joint_files_dict, f'{output_dir}/test_file_full.csv')
+        clusters_dict = None
+        if not metadata_only:
+            ############### MAIN WORKFLOW ###############
+            clusters_dict = executeClusterWorkflow(joint_files_dict, algorithm, source_dir, output_dir, k_values,
+                        random_samples, tuple(directories), project, max_plot_depth, changed_files)
+        # Files, symbols, edges and clusters in one database for ad-hoc SQL queries
+        if sqlite:
+            writeSqliteStore(files_dict, clusters_dict, sqlite_path)
+        return joint_files_dict
+
+    joint_files_dict = runWorkflow(files_dict, changed_files)
+    if sql_query:
+        columns, rows = querySqliteStore(sqlite_path, sql_query)
+        print(','.join(columns))
+        for row in rows:
+            print(','.join(map(str, row)))
+    if not watch:
+        return joint_files_dict
+
+    ############### WATCH MODE ###############
+    # Keep the files data and the symbol index in memory and only redo what the edits touch
+    symbol_index = SymbolIndex([file for sub_dict in files_dict.values() for file in sub_dict.values()],
+                               link_resolution)
+    watcher = SourceTreeWatcher(source_dir, directories)
+    if include_resolver is None:
+        include_resolver = getIncludeResolver(source_dir, include_paths)
+
+    def persistWatchState():
+        # Later runs (and --git_diff) start from the current state of the tree, saved with every weight layer
+        if macros_only or functions_only:
+            reconstrainFileReferences(files_dict, 'all')
+        saveFilesData(files_dict, files_data_path, getTreeRevision(source_dir), link_resolution)
+        if symbol_graph:
+            writeSymbolGraph(files_dict, symbol_graph_path, symbol_graph_outputs)
+        if macros_only or functions_only:
+            reconstrainFileReferences(files_dict, 'macros' if macros_only else 'functions')
+
+    # Saving rebuilds the whole store and symbol graph, so it waits until the tree has been quiet
+    # for watch_persist_delay seconds instead of running after every edit
+    last_change_time = None
+    print(f"Watching {', '.join(directories)} for changes, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(watch_interval)
+            changed_paths = watcher.poll(watch_interval)
+            if not changed_paths:
+                if last_change_time is not None and time.perf_counter() - last_change_time >= watch_persist_delay:
+                    persistWatchState()
+                    last_change_time = None
+                continue
+            start_time = time.perf_counter()
+            print(f"{len(changed_paths)} files changed: {', '.join(sorted(changed_paths))}")
+            # The views overwrite the edge weights, go back to every layer before patching the snapshot
+            if macros_only or functions_only:
+                reconstrainFileReferences(files_dict, 'all')
+            changed_files = updateFileDependencies(files_dict, changed_paths, source_dir, directories,
+                                                   antlr_err_outputs, jobs, file_parse_cache, antlr_options,
+                                                   include_paths, translation_units, parser_dfa_cache,
+                                                   dfa_warmup, build_defines, symbol_index,
+                                                   include_resolver=include_resolver)
+            joint_files_dict = runWorkflow(files_dict, changed_files)
+            last_change_time = time.perf_counter()
+            print(f"Updated the analysis in {last_change_time - start_time:.2f}s.")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        # Edits not saved yet are saved on the way out
+        if last_change_time is not None:
+            persistWatchState()
+    return joint_files_dict
+
+def main():
+    ############### INPUT VARIABLES ###############
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--source_dir", help = "Path to the source code directory.", required=True)
+    parser.add_argument("-o", "--outputs_dir", help = "Path to the directory to use for output files.", required=True)
+    parser.add_argument("-p", "--project", help = "The name of the project being analysed.", required=True)
+    parser.add_argument("-d", "--directories", help = "The list of sub-directories to observe in SOURCE_DIR.", nargs='+', required=True)
+    parser.add_argument("-a", "--algorithm", help = "The algorithm to use: 0 - Suboptimal, 1 - Genetic, 2 - Suboptimal (Weighted), 3 - Genetic (Weighted)", required=True, type=int)
+    parser.add_argument("--random_samples", help = "The number of random start points to cycle through for the algorithm.", default=1, type=int)
+    parser.add_argument("--heatmap", help = "Flag to print heatmaps instead of clusters.", default=0, type=int)
+    parser.add_argument("--macros_only", help = "Flag to only consider macro dependencies, not functions.", default=0, type=int)
+    parser.add_argument("--functions_only", help = "Flag to only consider function dependencies, not macros.", default=0, type=int)
+    parser.add_argument("--joint_files", help = "Flag to join files of the same name (.c, .h, and .c4).", default=1, type=int)
+    parser.add_argument("--max_plot_depth", help = "The number of directories to plot recursively (top level is 0).", default=3, type=int)
+    parser.add_argument("--parse_cache", help = "Flag to reuse the per-file parse cache for files that haven't changed.", default=1, type=int)
+    parser.add_argument("--two_stage_parse", help = "Flag to try a fast SLL parse first and only reparse with full LL when it fails.", default=0, type=int)
+    parser.add_argument("--time_budget", help = "Seconds of parse time allowed per file before falling back to token extraction (0 is unlimited).", default=0, type=float)
+    parser.add_argument("--token_budget", help = "Tokens allowed per file before falling back to token extraction (0 is unlimited).", default=0, type=int)
+    parser.add_argument("--max_syntax_errors", help = "Syntax errors allowed per file before giving up on the parse and falling back to token extraction (0 is unlimited).", default=0, type=int)
+    parser.add_argument("--extractor", help = "The symbol extractor to use: antlr - full parse, tokens - fast lexer-only heuristics.", default="antlr", choices=["antlr", "tokens"])
+    parser.add_argument("--extractor_sample", help = "The number of files to compare the token extractor against ANTLR on (0 is off).", default=0, type=int)
+    parser.add_argument("-I", "--include_paths", help = "Extra include search paths, tried in order after SOURCE_DIR and the including file's directory.", nargs='+', default=[])
+    parser.add_argument("--compile_commands", help = "Path to a compile_commands.json to take translation units, include paths and defines from.", default=None)
+    parser.add_argument("--reuse_snapshot", help = "Flag to load the files data saved by a previous run instead of extracting again.", default=0, type=int)
+    parser.add_argument("--dfa_cache", help = "Path to a saved parser DFA to start warm from, it's updated after every run that parses files. With JOBS > 1 only the states of the DFA_WARMUP files parsed before the workers start are saved, the workers' states aren't merged back.", default=None)
+    parser.add_argument("--dfa_warmup", help = "With JOBS > 1, the number of files to parse before starting the workers so they share the warmed DFA (one per worker if 0 and DFA_CACHE is given).", default=0, type=int)
+    parser.add_argument("--mask_conditionals", help = "Flag to blank out #if branches that are inactive for the given defines before extraction.", default=0, type=int)
+    parser.add_argument("-D", "--defines", help = "Macros to treat as defined (NAME or NAME=VALUE) when masking conditionals, any macro not given is unknown.", nargs='+', default=[])
+    parser.add_argument("-U", "--undefines", help = "Macros to treat as undefined when masking conditionals.", nargs='+', default=[])
+    parser.add_argument("--metadata_only", help = "Flag to only write the metadata CSV and skip clustering and plotting.", default=0, type=int)
+    parser.add_argument("--git_diff", help = "One or two git revisions (REV_A [REV_B]), only files changed between them are extracted and re-clustered. SOURCE_DIR must be checked out at REV_B (the working tree if not given), every file is extracted again if the saved snapshot isn't from REV_A.", nargs='+', default=None)
+    parser.add_argument("--watch", help = "Flag to keep running after the analysis and update it whenever files in the DIRECTORIES change.", default=0, type=int)
+    parser.add_argument("--watch_interval", help = "Seconds between polls of the source tree in watch mode.", default=1, type=float)
+    parser.add_argument("--watch_persist_delay", help = "Seconds without changes before watch mode saves the files data (and symbol graph), they're always saved when it stops.", default=30, type=float)
+    parser.add_argument("--symbol_graph", help = "Flag to also extract the function/macro level graph and save it with its directory level edges.", default=0, type=int)
+    parser.add_argument("--link_resolution", help = "Flag to link uses of functions/types no included file defines to the only file in the tree that defines them (--reuse_snapshot and watch mode keep the mode the snapshot was extracted with, --git_diff extracts every file again if it differs).", default=0, type=int)
+    parser.add_argument("--sqlite", help = "Flag to also write the files, symbols, definitions, uses, include edges and clusters to a SQLite database.", default=0, type=int)
+    parser.add_argument("--sql_query", help = "SQL query to run against the SQLite database after the analysis (needs --sqlite 1), the rows are printed as CSV.", default=None)
+    parser.add_argument("-j", "--jobs", help = "The number of worker processes to use for ANTLR extraction.", default=1, type=int)
+    args = parser.parse_args()
+
+    if args.macros_only and args.functions_only:
+        print("ERROR: only one flag out of macros_only and functions_only can be set at once!")
+        exit(1)
+    if args.sql_query and not args.sqlite:
+        parser.error("--sql_query needs --sqlite 1")
+
+    analyze(**vars(args))
+
+if __name__ == "__main__":
+    main()
@@ -25,12 +25,15 @@ else
 fi
 
 # Run everything
+# Only the first run extracts, the rest reuse its weight layers through the snapshot
+reuse_snapshot=0
 for extra_flag in "${extra_flags[@]}"; do
     # Run the cluster generation
     for algorithm in `seq 0 3`; do
         echo "Running $project with algorithm $algorithm, extra flags: $extra_flag"
         python ./main.py -s $source_dir -o $out_dir -p $project --random_samples 1 \
-                -d ${run_dirs[@]} -a $algorithm $extra_flag
+                -d ${run_dirs[@]} -a $algorithm $extra_flag --reuse_snapshot $reuse_snapshot
+        reuse_snapshot=1
     done
 done
 